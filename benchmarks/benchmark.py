@@ -0,0 +1,292 @@
+"""
+Benchmarks for building, simulating and post processing circuits
+Runs offline on the local qsim backend and writes the timings
+and gate counts as JSON so releases can be compared
+
+python benchmarks/benchmark.py --output results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+
+from qclass import qclass
+from qint import qint
+from qbool import qbool
+from qsim import qsim
+from qmetrics import qmetrics
+import numpy as np
+
+#Written into every report so the gate fields are read the right way
+NOTES = {
+    "gates": "gates, two_qubit_gates and depth count each mct as a single gate",
+    "expanded": "expanded_* fields count mct through qclass.decompose_mct and are null when qiskit is not installed",
+}
+
+
+def fresh_qclass(seed= 7):
+    """
+    Returns a started qclass on a seeded local backend
+    """
+    thisQclass = qclass(backend= qsim(seed= seed), seed= seed)
+    thisQclass.start()
+    return thisQclass
+
+def timed(build, repeat: int):
+    """
+    Calls build repeat times and returns the best time in seconds
+    along with whatever the last call returned
+    """
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        last = build()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, last
+
+def expanded_metrics(thisQclass):
+    """
+    Returns qmetrics for the circuit of thisQclass with every mct decomposed
+    or None if it holds mct gates and qiskit is not installed to decompose them
+    """
+    metrics = qmetrics()
+    try:
+        for instruction in thisQclass.instructions:
+            if instruction.name == "mct":
+                for gate in qclass.decompose_mct(instruction.qubits, instruction.params[0]):
+                    metrics.record(gate)
+            else:
+                metrics.record(instruction)
+    except ImportError:
+        return None
+    return metrics
+
+def record(name: str, params: dict, seconds: float, thisQclass= None):
+    """
+    Returns one result row with the circuit metrics of thisQclass if given
+    Both the recorded counts, with mct as one gate, and the expanded ones are kept
+    """
+    toReturn = {"name": name, "params": params, "seconds": seconds}
+    if thisQclass is not None:
+        metrics = thisQclass.metrics_dict()
+        toReturn["gates"] = metrics["total_gates"]
+        toReturn["two_qubit_gates"] = metrics["two_qubit_gates"]
+        toReturn["depth"] = metrics["depth"]
+        toReturn["peak_qubits"] = metrics["peak_qubits"]
+        expanded = expanded_metrics(thisQclass)
+        toReturn["expanded_gates"] = None if expanded is None else sum(expanded.gates.values())
+        toReturn["expanded_two_qubit_gates"] = None if expanded is None else expanded.twoQubitGates
+        toReturn["expanded_depth"] = None if expanded is None else expanded.depth
+    return toReturn
+
+def bench_qint_init(repeat: int):
+    results = []
+    for size in (5, 14, 32):
+        def build():
+            thisQclass = fresh_qclass()
+            qint(thisQclass, value= 2**size - 1, size= size)
+            return thisQclass
+        seconds, thisQclass = timed(build, repeat)
+        results.append(record("qint.__init__", {"size": size}, seconds, thisQclass))
+    return results
+
+def bench_increment(repeat: int):
+    results = []
+    for size in (5, 14, 32):
+        def build():
+            thisQclass = fresh_qclass()
+            qint(thisQclass, value= 1, size= size).increment()
+            return thisQclass
+        seconds, thisQclass = timed(build, repeat)
+        results.append(record("qint.increment", {"size": size}, seconds, thisQclass))
+    return results
+
+def bench_increment_paths(repeat: int):
+    """
+    Compares the two ways of incrementing on a backend that decomposes mct
+    The named backend is never looked up so no account is needed, and the
+    qubit budget leaves room for the adder's carries at every size
+    The cascade's expanded counts need qiskit to decompose its mct gates
+    """
+    results = []
+    paths = {"adder": lambda a: a.add_const(1), "cascade": lambda a: a._increment_cascade()}
+    for size in (5, 14, 32):
+        for path, increment in paths.items():
+            def build():
+                thisQclass = qclass(backend= "ibmq_qasm_simulator", size= 2*size)
+                thisQclass.start()
+                increment(qint(thisQclass, value= 1, size= size))
+                return thisQclass
+            seconds, thisQclass = timed(build, repeat)
+            results.append(record("qint.increment", {"size": size, "path": path}, seconds, thisQclass))
+    return results
+
+def bench_super_position(repeat: int, counts= (2, 8, 64, 256, 1024)):
+    results = []
+    for count in counts:
+        nums = random.Random(count).sample(range(2**11), count)
+        def build():
+            thisQclass = fresh_qclass()
+            qint.super_position(nums, thisQclass, size= 11)
+            return thisQclass
+        seconds, thisQclass = timed(build, repeat)
+        results.append(record("qint.super_position", {"values": count}, seconds, thisQclass))
+    return results
+
+def bench_qbool(repeat: int, widths= (4, 8, 16)):
+    results = []
+    for name in ("qand", "qor", "qnand", "qxor", "qiff", "qif"):
+        def build():
+            thisQclass = fresh_qclass()
+            a = qbool(thisQclass, initial= True)
+            b = qbool(thisQclass, prob= 0.5)
+            getattr(a, name)(b)
+            return thisQclass
+        seconds, thisQclass = timed(build, repeat)
+        results.append(record("qbool." + name, {}, seconds, thisQclass))
+    for name in ("qmand", "qmor"):
+        for width in widths:
+            def build():
+                thisQclass = fresh_qclass()
+                inputs = [qbool(thisQclass, prob= 0.5) for i in range(width)]
+                getattr(inputs[0], name)(inputs[1:])
+                return thisQclass
+            seconds, thisQclass = timed(build, repeat)
+            results.append(record("qbool." + name, {"inputs": width}, seconds, thisQclass))
+    return results
+
+def bench_run(repeat: int, shots= 1024):
+    """
+    Times building and simulating measured circuits end to end
+    Sizes stay within the statevector limit of qsim except for the wide
+    increment, which stays in basis states and runs as integer bit operations,
+    and the wide all_vals, which is Clifford and runs on a stabilizer tableau
+    """
+    results = []
+    def increment_program(thisQclass):
+        a = qint(thisQclass, value= 9, size= 5)
+        a.increment()
+        a.measure()
+    def wide_increment_program(thisQclass):
+        a = qint(thisQclass, value= 2**31 - 1, size= 32)
+        a.increment()
+        a.measure()
+    def wide_all_vals_program(thisQclass):
+        a = qint(thisQclass, size= 32)
+        a.all_vals()
+        a.measure()
+    def superposition_program(thisQclass):
+        a = qint.super_position([1, 6, 9, 14, 22, 31], thisQclass, size= 5)
+        a.measure()
+    def qbool_program(thisQclass):
+        inputs = [qbool(thisQclass, prob= 0.5) for i in range(8)]
+        inputs[0].qmand(inputs[1:]).measure()
+    for name, program in (("increment", increment_program), ("wide_increment", wide_increment_program), ("wide_all_vals", wide_all_vals_program), ("super_position", superposition_program), ("qmand", qbool_program)):
+        def build():
+            thisQclass = fresh_qclass()
+            program(thisQclass)
+            thisQclass.run(shots= shots)
+            return thisQclass
+        seconds, thisQclass = timed(build, repeat)
+        results.append(record("qclass.run", {"program": name, "shots": shots}, seconds, thisQclass))
+        results[-1]["engine"] = thisQclass.engine
+    return results
+
+def bench_extract_counts(repeat: int, outcomes= (256, 4096, 65536)):
+    """
+    Times extracting one and two registers from synthetic counts
+    """
+    results = []
+    thisQclass = fresh_qclass()
+    a = qint(thisQclass, size= 8)
+    b = qint(thisQclass, size= 8)
+    a.measure()
+    b.measure()
+    for count in outcomes:
+        rng = random.Random(count)
+        counts = {}
+        for i in range(count):
+            key = format(rng.getrandbits(16), "016b")
+            counts[key] = counts.get(key, 0) + rng.randint(1, 100)
+        seconds, last = timed(lambda: a.extract_counts(counts), repeat)
+        results.append(record("qint.extract_counts", {"outcomes": len(counts)}, seconds))
+        seconds, last = timed(lambda: thisQclass.extract_counts(counts, a, b), repeat)
+        results.append(record("qclass.extract_counts", {"outcomes": len(counts), "registers": 2}, seconds))
+    return results
+
+#Run in a fresh interpreter so nothing is imported yet
+STARTUP = """
+import json, sys, time
+start = time.perf_counter()
+from qint import qint
+from qclass import qclass
+imported = time.perf_counter()
+thisQclass = qclass(backend= "ibmq_qasm_simulator")
+thisQclass.start()
+qint(thisQclass, value= 5).increment()
+built = time.perf_counter()
+print(json.dumps({"import": imported - start, "first_gate": built - start, "qiskit_imported": "qiskit" in sys.modules}))
+"""
+
+def bench_startup(repeat: int):
+    """
+    Times importing qint and qclass and recording the first gates
+    on a named backend in a fresh interpreter
+    """
+    env = dict(os.environ, PYTHONPATH= os.pathsep.join([SRC] + [p for p in [os.environ.get("PYTHONPATH")] if p]))
+    runs = []
+    for i in range(repeat):
+        output = subprocess.run([sys.executable, "-c", STARTUP], env= env, stdout= subprocess.PIPE, check= True).stdout
+        runs.append(json.loads(output.decode()))
+    toReturn = record("startup", {"backend": "ibmq_qasm_simulator"}, min(run["first_gate"] for run in runs))
+    toReturn["import_seconds"] = min(run["import"] for run in runs)
+    toReturn["qiskit_imported"] = runs[-1]["qiskit_imported"]
+    return [toReturn]
+
+SUITES = {
+    "startup": bench_startup,
+    "qint_init": bench_qint_init,
+    "increment": bench_increment,
+    "increment_paths": bench_increment_paths,
+    "super_position": bench_super_position,
+    "qbool": bench_qbool,
+    "run": bench_run,
+    "extract_counts": bench_extract_counts,
+}
+
+def main(argv= None):
+    parser = argparse.ArgumentParser(description= "Benchmarks qpy on the local simulator")
+    parser.add_argument("--output", help= "file to write the JSON results to instead of stdout")
+    parser.add_argument("--repeat", type= int, default= 3, help= "times to run each case, the best time is kept")
+    parser.add_argument("--only", nargs= "+", choices= sorted(SUITES), help= "suites to run")
+    args = parser.parse_args(argv)
+    results = []
+    for name in args.only or SUITES:
+        results += SUITES[name](args.repeat)
+    report = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "repeat": args.repeat,
+        "notes": NOTES,
+        "results": results,
+    }
+    output = json.dumps(report, indent= 2, sort_keys= True)
+    if args.output:
+        with open(args.output, 'w') as outFile:
+            outFile.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+from __future__ import annotations
+import heapq
+
+class qallocator(object):
+    """
+    Allocator for a fixed pool of qubit or classical bit indices
+    Always hands out the lowest free indices first to keep
+    the emitted registers compact
+    Given a qtopology it instead hands out connected physical qubits
+    """
+    def __init__(self, size: int, topology= None):
+        self.size = size
+        self.topology = topology
+        #Min heap of free indices, may hold stale entries for indices in use
+        #A topology places qubits itself so the heap is left empty
+        self._heap = list(range(size)) if topology is None else []
+        self._queued = bytearray([topology is None]) * size #1 for indices with an entry in the heap
+        self._free = bytearray([1]) * size
+        self._dirty = bytearray(size) #1 for indices measured and not reset since, which must not be recycled
+        self.inUse = 0
+        self.peak = 0 #Most indices in use at once
+        self.highWater = 0 #One past the highest index ever handed out
+        self.allocations = 0
+
+    @property
+    def available(self):
+        """
+        The number of free indices
+        """
+        return self.size - self.inUse
+
+    def is_free(self, index: int):
+        return bool(self._free[index])
+
+    def _take(self, indices: list):
+        """
+        Marks indices as in use and updates the counters
+        """
+        for index in indices:
+            self._free[index] = 0
+        self.inUse += len(indices)
+        self.peak = max(self.peak, self.inUse)
+        if indices:
+            self.highWater = max(self.highWater, max(indices) + 1)
+        self.allocations += 1
+
+    def allocate(self, n: int, near= ()):
+        """
+        Returns the n lowest free indices, or with a topology the n free
+        qubits closest to each other and to the qubits in near
+        Raises an OverflowError if fewer than n are free
+        """
+        if n > self.available:
+            raise OverflowError("Requested %d indices but only %d are free" % (n, self.available))
+        if self.topology is not None and n > 0:
+            toReturn = self.topology.place([i for i in range(self.size) if self._free[i]], n, near)
+            self._take(toReturn) #Their heap entries go stale and are skipped when popped
+            return toReturn
+        toReturn = []
+        while len(toReturn) < n:
+            index = heapq.heappop(self._heap)
+            self._queued[index] = 0
+            if self._free[index]:
+                self._free[index] = 0
+                toReturn.append(index)
+        self._take(toReturn)
+        return toReturn
+
+    def allocate_range(self, n: int):
+        """
+        Returns the lowest run of n consecutive free indices
+        Raises an OverflowError if no such run exists
+        """
+        run = 0
+        for index in range(self.size):
+            run = run + 1 if self._free[index] else 0
+            if run == n:
+                toReturn = list(range(index - n + 1, index + 1))
+                self._take(toReturn) #Their heap entries go stale and are skipped when popped
+                return toReturn
+        raise OverflowError("No run of %d consecutive free indices" % n)
+
+    def claim(self, indices):
+        """
+        Marks the given free indices as in use
+        Raises a ValueError if any of them is already in use
+        """
+        indices = list(indices)
+        for index in indices:
+            if not self._free[index]:
+                raise ValueError("index %d is already in use" % index)
+        self._take(indices) #Their heap entries go stale and are skipped when popped
+        return indices
+
+    def request(self, n: int, near= ()):
+        """
+        Returns n free indices if there are enough
+        and False otherwise
+        """
+        if n <= 0:
+            return []
+        if n > self.available:
+            return False
+        return self.allocate(n, near)
+
+    def mark_dirty(self, indices):
+        """
+        Records that indices were measured and can not be recycled until they are reset
+        """
+        for index in indices:
+            self._dirty[index] = 1
+
+    def mark_clean(self, indices):
+        """
+        Records that indices were reset to |0>
+        """
+        for index in indices:
+            self._dirty[index] = 0
+
+    def is_dirty(self, index: int):
+        return bool(self._dirty[index])
+
+    def free(self, indices):
+        """
+        Returns indices to the pool
+        Raises a ValueError for indices that are already free or
+        were measured and not reset since
+        """
+        for index in indices:
+            if self._free[index]:
+                raise ValueError("index %d is already free" % index)
+            if self._dirty[index]:
+                raise ValueError("index %d was measured and must be reset before it is freed" % index)
+            self._free[index] = 1
+            if self.topology is None and not self._queued[index]:
+                self._queued[index] = 1
+                heapq.heappush(self._heap, index)
+        self.inUse -= len(indices)
@@ -1,5 +1,7 @@
 from __future__ import annotations
 from qclass import qclass
+from qmetrics import instrumented
+from qparam import qparam
 
 class qbool(object):
     """
@@ -8,19 +10,22 @@ class qbool(object):
     def __init__(self, qclass: qclass, initial = None, prob = None):
         self.qclass = qclass
         self.qubit = self.qclass.chunk(1)[0]
-        if type(initial) == bool:
-            if initial:
-                self.qclass.ugate('x', self.qubit)
-        elif type(prob) == float:
-            self.qclass.q_prob(self.qubit, prob)
+        self.classBit = None
+        with self.qclass.metrics.track("qbool.__init__"):
+            if type(initial) == bool:
+                if initial:
+                    self.qclass.ugate('x', self.qubit)
+            elif type(prob) == float or isinstance(prob, qparam):
+                self.qclass.q_prob(self.qubit, prob)
     
+    @instrumented
     def entangle(self):
         """
         Returns a new qbool object whose current probability of being
         true is the same as the current probability
         """
         b = qbool(self.qclass) #Make a fresh qubit
-        return _entangle_fresh(b)
+        return self._entangle_fresh(b)
 
     def _entangle_fresh(self, b: qbool):
         """
@@ -29,21 +34,25 @@ class qbool(object):
         self.qclass.cx(self.qubit, b.qubit)
         return b
 
-    def measure(self):
+    @instrumented
+    def measure(self, reset= False):
         """
         Allots a classical bit and measures the qbool
         storing the result in said classical bit
+        With reset the qubit is reset and freed for reuse
         """
         self.classBit = self.qclass.chunk_class(1)[0]
-        self.qclass.write("measure q[%d] " % self.qubit + "-> c[%d]; \n" % self.classBit)
+        self.qclass.measure(self.qubit, self.classBit)
         self.qclass.collapsed = True
+        if reset:
+            self.free()
 
     def extract_result(self, result):
         """
         Extracts the truth value for the qbool
         from the qclass result object
         """
-        if classBit is None:
+        if self.classBit is None:
             raise RuntimeError("qbool was never measured so it can not be extracted")
         if result[self.classBit] == '1':
             return True
@@ -54,15 +63,25 @@ class qbool(object):
         """
         Extracts the counts for each truth balue for the qbool
         """
-        toReturn = {}
-        for string, count in counts.items():
-            result = self.extract_result(string)
-            try:
-                toReturn[result] += count
-            except KeyError:
-                toReturn[result] = count
-        return toReturn
+        if self.classBit is None:
+            raise RuntimeError("qbool was never measured so it can not be extracted")
+        return self.qclass.extract_counts(counts, self)
+
+    def probability(self, values= None):
+        """
+        Returns the exact probability of the qbool being true
+        from a statevector simulation, see qclass.get_probabilities
+        """
+        return self.qclass.get_probabilities(self, values= values).get(True, 0.0)
 
+    @property
+    def classBits(self):
+        return [self.classBit]
+
+    def _from_int(self, value: int):
+        return bool(value)
+
+    @instrumented
     def qand(self, other: qbool):
         """
         Applies a quantum and gate to 2 qbool objects
@@ -72,6 +91,7 @@ class qbool(object):
         self.qclass.ccx(self.qubit, other.qubit, result.qubit)
         return result
 
+    @instrumented
     def qor(self, other: qbool):
         """
         Applies a quantum or gate to 2 qbool objects
@@ -86,6 +106,7 @@ class qbool(object):
         self.qclass.ugate("x", other.qubit)
         return result
     
+    @instrumented
     def qnot(self):
         """
         Nots the qbool
@@ -93,6 +114,7 @@ class qbool(object):
         """
         self.qclass.ugate("x", self.qubit)
 
+    @instrumented
     def qnand(self, other: qbool):
         """
         Applies a quantum nand gate with the
@@ -102,6 +124,7 @@ class qbool(object):
         result.qnot()
         return result
 
+    @instrumented
     def qxor(self, other: qbool):
         """
         Applies a quantum xor gate with
@@ -116,6 +139,7 @@ class qbool(object):
         self.qclass.ugate("x", other.qubit)
         return result
 
+    @instrumented
     def qiff(self, other: qbool):
         """
         Applies the biimplication <=>
@@ -130,6 +154,7 @@ class qbool(object):
         self.qclass.ugate("x", self.qubit)
         return result
 
+    @instrumented
     def qif(self, other: qbool):
         """
         Applies the implication =>
@@ -141,12 +166,14 @@ class qbool(object):
         return result
 
     
+    @instrumented
     def iqand(self, first: qbool, other: qbool):
         """
         Inverts the qand gate
         """
         first.qclass.ccx(first.qubit, other.qubit, self.qubit)
 
+    @instrumented
     def iqor(self, first: qbool, other: qbool):
         """
         Inverts the qor gate
@@ -158,6 +185,7 @@ class qbool(object):
         self.qclass.ugate("x", other.qubit)
         self.qclass.ugate("x", self.qubit)
         
+    @instrumented
     def iqnand(self, first: qbool, other: qbool):
         """
         Inverts the qnand gate
@@ -165,6 +193,7 @@ class qbool(object):
         self.qnot()
         self.iqand(first, other)
 
+    @instrumented
     def iqxor(self, first: qbool, other: qbool):
         """
         Inverts the qxor gate
@@ -176,6 +205,7 @@ class qbool(object):
         self.qclass.ccx(first.qubit, other.qubit, self.qubit)
         self.qclass.ugate("x", other.qubit)
 
+    @instrumented
     def iqiff(self, first: qbool, other: qbool):
         """
         Inverts the qiff gate
@@ -187,6 +217,7 @@ class qbool(object):
         self.qclass.ugate("x", other.qubit)
         self.qclass.ugate("x", first.qubit)
 
+    @instrumented
     def iqif(self, first: qbool, other: qbool):
         """
         Inverts the qif gate
@@ -205,6 +236,7 @@ class qbool(object):
         self.qclass.return_chunk([self.qubit])
         self.qubit = None
 
+    @instrumented
     def qmand(self, others: list):
         """
         Ands every qbool in an iterable with self and returns the
@@ -214,9 +246,9 @@ class qbool(object):
         if self not in others:
             others.append(self)
             popatTheEnd = True
-        result = qbool()
+        result = qbool(self.qclass)
         control = [x.qubit for x in others]
-        ancillary = self.qclass.request_chunk(len(control)-2)
+        ancillary = self.qclass.request_chunk(len(control)-2, near= control)
         self.qclass.mct(control, result.qubit, ancillary=ancillary)
         self.qclass.return_chunk(ancillary)
         if popatTheEnd:
@@ -224,6 +256,7 @@ class qbool(object):
             others.pop()
         return result
     
+    @instrumented
     def iqmand(self, first: qbool, others: list):
         """
         Inverts the qmand gate
@@ -233,12 +266,13 @@ class qbool(object):
             others.append(first)
             popatTheEnd = True
         control = [x.qubit for x in others]
-        ancillary = self.qclass.request_chunk(len(control)-2)
+        ancillary = self.qclass.request_chunk(len(control)-2, near= control)
         self.qclass.mct(control, self.qubit, ancillary=ancillary)
         self.qclass.return_chunk(ancillary)
         if popatTheEnd:
             others.pop()
     
+    @instrumented
     def qmor(self, others: list):
         """
         Ors every qbool in an iterable with self 
@@ -248,9 +282,9 @@ class qbool(object):
         if self not in others:
             others.append(self)
             popatTheEnd = True
-        result  = qbool()
+        result = qbool(self.qclass)
         control = [x.qubit for x in others]
-        ancillary = self.qclass.request_chunk(len(control)-2)
+        ancillary = self.qclass.request_chunk(len(control)-2, near= control)
         for x in control:
             self.qclass.ugate("x", x)
         self.qclass.ugate("x", result.qubit)
@@ -262,6 +296,7 @@ class qbool(object):
             others.pop()
         return result
 
+    @instrumented
     def iqmor(self, first: qbool, others: list):
         """
         Inverts the qmor gate
@@ -271,7 +306,7 @@ class qbool(object):
             others.append(first)
             popatTheEnd = True
         control = [x.qubit for x in others]
-        ancillary = self.qclass.request_chunk(len(control)-2)
+        ancillary = self.qclass.request_chunk(len(control)-2, near= control)
         for x in control:
             self.qclass.ugate("x", x)
         self.qclass.mct(control, self.qubit, ancillary=ancillary)
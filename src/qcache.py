@@ -0,0 +1,147 @@
+from __future__ import annotations
+from collections import OrderedDict
+import threading
+import hashlib
+import json
+import os
+import pickle
+
+class qcache(object):
+    """
+    Two tier cache with an in memory LRU in front of
+    an optional directory on disk bounded by total size
+    Values are pickled on disk unless a subclass chooses another
+    serialization, so only use a directory you trust
+    """
+    suffix = ".pickle"
+
+    def __init__(self, maxEntries= 256, directory= None, maxBytes= 64*2**20):
+        self.maxEntries = maxEntries
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.diskHits = 0
+        self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok= True)
+
+    @staticmethod
+    def digest(*parts):
+        """
+        Returns a stable hex key for the canonical reprs of parts
+        """
+        return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+    def _dump(self, value):
+        return pickle.dumps(value)
+
+    def _load(self, data: bytes):
+        return pickle.loads(data)
+
+    def _path(self, key: str):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key: str):
+        """
+        Returns the cached value for key or None
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+        if self.directory is not None and os.path.exists(self._path(key)):
+            try:
+                with open(self._path(key), 'rb') as cached:
+                    value = self._load(cached.read())
+                os.utime(self._path(key)) #Recently used files are evicted last
+            except (OSError, ValueError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+                value = None #A corrupt or stale file is a miss
+            if value is not None:
+                with self._lock:
+                    self.hits += 1
+                    self.diskHits += 1
+                self._remember(key, value)
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _remember(self, key: str, value):
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.maxEntries:
+                self._memory.popitem(last= False)
+
+    def put(self, key: str, value):
+        """
+        Stores value in memory and on disk if a directory was given
+        """
+        self._remember(key, value)
+        if self.directory is not None:
+            with open(self._path(key), 'wb') as cached:
+                cached.write(self._dump(value))
+            self._evict()
+
+    def _evict(self):
+        """
+        Removes the least recently used files until the directory fits in maxBytes
+        """
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.suffix):
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for mtime, size, path in files)
+        for mtime, size, path in sorted(files):
+            if total <= self.maxBytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def clear(self):
+        """
+        Empties both tiers
+        """
+        with self._lock:
+            self._memory.clear()
+        if self.directory is not None:
+            for name in os.listdir(self.directory):
+                if name.endswith(self.suffix):
+                    os.remove(os.path.join(self.directory, name))
+
+    def stats(self):
+        """
+        Returns the hit and miss counts as a dict
+        """
+        return {"hits": self.hits, "disk_hits": self.diskHits, "misses": self.misses, "entries": len(self._memory)}
+
+
+class resultcache(qcache):
+    """
+    Cache of counts dicts keyed on the circuit,
+    backend, shot count and seed that produced them
+    """
+    suffix = ".json"
+
+    def _dump(self, value):
+        return json.dumps(value, sort_keys= True).encode()
+
+    def _load(self, data: bytes):
+        return json.loads(data.decode())
+
+    def get(self, key: str):
+        counts = super().get(key)
+        return dict(counts) if counts is not None else None
+
+
+class transpilecache(qcache):
+    """
+    Cache of transpiled qiskit circuits keyed on the circuit structure
+    and the backend configuration they were transpiled for
+    Circuits are pickled on disk so only use a directory you trust
+    """
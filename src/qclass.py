@@ -1,10 +1,58 @@
 from __future__ import annotations
-from qiskit import QuantumCircuit, QuantumRegister, execute, IBMQ
-from qiskit.aqua.circuits.gates import mct
+from collections import namedtuple
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, Future
+from qsim import qsim
+from qallocator import qallocator
+import qoptimizer
+from qcache import qcache, transpilecache
+from qmetrics import qmetrics
+from qscope import qscope
+from qparam import qparam, qexpr, bind, is_symbolic
+from qtopology import qtopology
+import numpy as np
+import asyncio
+import threading
 import uuid
 import random
 import math
-import re
+
+#A single recorded instruction: gate name, qubit indices, classical bit indices and gate parameters
+qop = namedtuple("qop", ["name", "qubits", "clbits", "params"])
+
+@lru_cache(maxsize= 128)
+def _mct_template(numControls: int, numAncillas: int):
+    """
+    Decomposes an mct gate once per shape into a tuple of
+    (gate name, slots, params) where slots index into the
+    controls followed by the ancillas and then the target
+    """
+    from qiskit import QuantumCircuit, QuantumRegister
+    from qiskit.aqua.circuits.gates import mct #Adds mct to QuantumCircuit
+    q = QuantumRegister(numControls + numAncillas + 1)
+    qc = QuantumCircuit(q)
+    controls = [q[i] for i in range(numControls)]
+    ancillaries = [q[i + numControls] for i in range(numAncillas)]
+    if ancillaries:
+        qc.mct(controls, q[numControls + numAncillas], ancillaries, mode='basic')
+    else:
+        qc.mct(controls, q[numControls + numAncillas], None, mode='noancilla')
+    slots = {qubit: i for i, qubit in enumerate(q)}
+    template = []
+    for instruction, qargs, cargs in qc.data:
+        template.append((instruction.name, tuple(slots[qarg] for qarg in qargs), tuple(float(p) for p in instruction.params)))
+    return tuple(template)
+
+def _binomial_tail(k: int, n: int):
+    """
+    Returns P(X >= k) for X binomially distributed over n fair coin flips
+    Summed in log space so large n does not overflow
+    """
+    if k <= 0:
+        return 1.0
+    logs = [math.lgamma(n + 1) - math.lgamma(i + 1) - math.lgamma(n - i + 1) - n*math.log(2) for i in range(k, n + 1)]
+    top = max(logs)
+    return min(1.0, math.exp(top)*sum(math.exp(x - top) for x in logs))
 
 class qclass(object):
     """
@@ -12,31 +60,115 @@ class qclass(object):
     Keeping a set of quantum registers and qubits
     One qclass compiles to a single quantum circuit
     """
-    def __init__(self, backend= None, qasmDir= uuid.uuid4().hex):
+    concurrency = 8 #Most jobs run_future and run_async keep in flight at once
+    _executor = None
+    _executorLock = threading.Lock()
+    #Qubits on each backend by name so a qclass can be built without contacting IBMQ
+    #Backends resolved later are added so their size is only looked up once
+    backendSizes = {"ibmq_qasm_simulator": 32, "ibmq_16_melbourne": 14, "ibmqx4": 5}
+    #Transpiled circuits shared by every qclass, set to None to always transpile
+    #or replace with a transpilecache with a directory to keep them between processes
+    transpileCache = transpilecache(maxEntries= 64)
+    optimizationLevel = 1 #qiskit transpiler optimization level
+    localFastPath = False #Opt in to running classical and Clifford circuits on qsim instead of on a remote simulator
+
+    def __init__(self, backend= None, qasmDir= None, cache= None, seed= None, size= None, couplingMap= None):
         """
-        Initialize a qasm file and choose a backend
+        Choose a backend and start an empty instruction list
+        A backend given by name is only looked up when the circuit first runs
+        qasmDir is only used if the circuit is exported with save_qasm
+        cache is an optional resultcache that get_counts checks before running
+        seed is passed to the simulator so runs can be reproduced
+        size is the qubit budget, which defaults to the size of the backend
+        couplingMap is a list of connected pairs of physical qubits, or True to
+        use the backend's, to place chunks on connected qubits (see swap_report)
+        start raises a ValueError if True is given for a backend without one, such as a simulator
         """
+        self._backend = None
         if not backend:
-            self._initialize_backend()
-        elif type(backend) == str:
-            self._initialize_backend(backend)
+            backend = "ibmq_qasm_simulator"
+        if type(backend) == str:
+            self.backendName = backend
+            if backend == "qsim":
+                self._initialize_backend(backend)
         else:
             self.backend = backend
-        self.size = self.backend.configuration().n_qubits
+        if size is None:
+            size = self.backendSizes.get(self.backendName)
+        if size is None:
+            size = self.backend.configuration().n_qubits
+        self.size = size
+        if qasmDir is None:
+            qasmDir = uuid.uuid4().hex
         self.qasmDir = qasmDir
         self.qasmDir += '.txt' #TO DO tests and change to .qasm
-        self.output = open(self.qasmDir, 'a+')
+        self.instructions = []
+        self.counts = None
+        self.engine = None #What ran the circuit last, a qsim engine or the name of a remote backend
+        self.optimizationReport = None
+        self.cache = cache
+        self.seed = seed
+        self.metrics = qmetrics()
+        self.parameters = {} #qexpr -> qiskit Parameter for lowered templates
+        self.couplingMap = couplingMap
+        self.topology = None
         self.collapsed = False
 
     @property
     def bitsLeft(self):
-        if self._nextQubit is not None:
-            return len(self._availableQubits) + 1
-        else:
-            return 0
+        return self.qubitAllocator.available
+
+    @property
+    def nativeMct(self):
+        """
+        Whether the backend applies mct gates directly instead of
+        decomposing them, so their ancillas never widen the simulation
+        """
+        return isinstance(self._backend, qsim)
+
+    def append(self, name: str, qubits, clbits= (), params= ()):
+        """
+        Records a single instruction acting on the given
+        qubit and classical bit indices
+        """
+        instruction = qop(name, tuple(qubits), tuple(clbits), tuple(params))
+        self.instructions.append(instruction)
+        self.metrics.record(instruction)
+        if self.topology is not None and len(instruction.qubits) > 1 and name != "barrier":
+            numControls = params[0] if name == "mct" else None
+            self.swaps += self.topology.swaps(instruction.qubits, numControls)
+            self.naiveSwaps += self.topology.swaps([self._naive.get(q, q) for q in instruction.qubits], numControls)
+        self.counts = None #Any stored counts are for a different circuit now
+
+    def add_hook(self, hook):
+        """
+        Registers hook to be called with every recorded instruction and
+        the qint/qbool operation (such as "qint.increment") that emitted it
+        """
+        self.metrics.hooks.append(hook)
 
-    def write(self, toWrite):
-        self.output.write(toWrite)
+    def metrics_dict(self):
+        """
+        Returns gate counts by type and by operation, the two qubit gate count,
+        estimated depth and current and peak qubit usage as a dict
+        """
+        return self.metrics.to_dict(self.qubitAllocator)
+
+    def metrics_json(self):
+        """
+        Returns metrics_dict as a JSON string
+        """
+        return self.metrics.to_json(self.qubitAllocator)
+
+    def swap_report(self):
+        """
+        Returns the swaps the gates so far are estimated to need on the
+        coupling map, the estimate had chunks been handed out lowest
+        index first, and the difference
+        """
+        if self.topology is None:
+            raise RuntimeError("swap_report needs a qclass made with a couplingMap")
+        return {"swaps": self.swaps, "naive_swaps": self.naiveSwaps, "swaps_saved": self.naiveSwaps - self.swaps}
 
     def chunk_class(self, bits: int):
         """
@@ -44,44 +176,52 @@ class qclass(object):
         """
         if bits <= 0:
             raise ValueError("bits must be a positive integer")
-        if bits > len(self._availableClassBits) + 1:
+        if bits > self.classAllocator.available:
             raise OverflowError("Insufficient classical bits on the chosen backend")
-        toReturn = []
-        while len(toReturn) < bits:
-            toReturn.append(self._nextClassBit)
-            self._nextClassBit = self._availableClassBits.pop(0)
-        return toReturn
+        return self.classAllocator.allocate(bits)
 
-    def chunk(self, bits: int):
+    def chunk(self, bits: int, contiguous= False, near= ()):
         """
         Allots qubits from memory
         Returns a list of qubit indices  
+        Set contiguous to get a run of consecutive indices, which ignores
+        the coupling map as consecutive indices need not be connected
+        With a coupling map the qubits are placed close to each other and to near
         """
         if bits <= 0:
             raise ValueError("bits must be a positive integer")
-        if bits > len(self._availableQubits) + 1:
+        if bits > self.bitsLeft:
             raise OverflowError("Insufficient qubits on the chosen backend")
-        toReturn = []
-        while len(toReturn) < bits:
-            try:
-                toReturn.append(self._nextQubit)
-                self._nextQubit = self._availableQubits.pop(0)
-            except IndexError:
-                self._nextQubit = None
-        return toReturn
+        if contiguous:
+            return self._shadow(self.qubitAllocator.allocate_range(bits))
+        return self._shadow(self.qubitAllocator.allocate(bits, near))
+
+    def _shadow(self, qubits):
+        """
+        Allocates the same number of qubits from the naive allocator
+        so gates can be costed under both placements
+        """
+        if self.topology is not None and qubits:
+            self._naive.update(zip(qubits, self.naiveAllocator.allocate(len(qubits))))
+        return qubits
 
     def return_chunk(self, bits: list):
         """
         Returns a list of temporary qubits to available qubits
         Be sure to reset these qubits to be 0 before returning them
+        Measured qubits are reset here so they can be reused
         """
-        self._availableQubits += bits
-        if self._nextQubit is None and bits:
-            self._nextQubit = self._availableQubits.pop(0)
+        if bits:
+            for qubit in bits:
+                if self.qubitAllocator.is_dirty(qubit):
+                    self.reset(qubit)
+            self.qubitAllocator.free(bits)
+            if self.topology is not None:
+                self.naiveAllocator.free([self._naive.pop(q) for q in bits if q in self._naive])
 
     def start(self, quantSize= None, classSize= None):
         """
-        provides the starting point for the qasm file
+        Sets the register sizes and clears any recorded instructions
         """
         if quantSize is None:
             quantSize = self.size
@@ -96,37 +236,275 @@ class qclass(object):
             quantSize = self.size
         if classSize is None:
             classSize = self.size 
-        toWrite = """
-        OPENQASM 2.0;
-        include "qelib1.inc";
-        qreg q[$$QSIZE$$]; 
-        creg c[$$CSIZE$$]; \n
-        """
-        toWrite = toWrite.replace("$$QSIZE$$", str(quantSize))
-        toWrite = toWrite.replace("$$CSIZE$$", str(classSize))
-        self.output.write(toWrite)
+        self.instructions = []
+        self.counts = None
+        self.parameters = {}
+        self.metrics = qmetrics(hooks= self.metrics.hooks) #Hooks outlive a restart
         self.size = quantSize
-        self._availableQubits = [x for x in range(0, self.size)]
-        self._nextQubit = self._availableQubits.pop(0)
-        self._availableClassBits = [x for x in range(0, classSize)]
-        self._nextClassBit = self._availableClassBits.pop(0)
+        self.classSize = classSize
+        self.classAllocator = qallocator(classSize)
+        self.topology = None
+        if self.couplingMap:
+            couplingMap = self.couplingMap
+            if couplingMap is True:
+                couplingMap = getattr(self.backend.configuration(), "coupling_map", None)
+                if not couplingMap:
+                    raise ValueError("backend %s has no coupling map" % self.backendName)
+            self.topology = qtopology([edge for edge in couplingMap if max(edge) < quantSize], quantSize)
+        self.qubitAllocator = qallocator(quantSize, self.topology)
+        #Shadow of the lowest index first policy used to report the swaps the topology saves
+        self.naiveAllocator = qallocator(quantSize)
+        self._naive = {} #qubit -> where the naive policy would have put it
+        self.swaps = 0
+        self.naiveSwaps = 0
 
     def _initialize_backend(self, backend="ibmq_qasm_simulator"):
+        if backend == "qsim":
+            #Local statevector simulator which needs no IBMQ account
+            self.backend = qsim()
+            return
+        from qiskit import IBMQ
         #self.backend = IBMQ.get_backend(backend)
         #TO-DO once IBMQ.get_provider() actually works use that
         self.backend = IBMQ.get_provider().get_backend(backend)
 
+    @property
+    def backend(self):
+        """
+        The backend circuits run on, looked up by name on first use
+        """
+        if self._backend is None:
+            self._initialize_backend(self.backendName)
+        return self._backend
+
+    @backend.setter
+    def backend(self, backend):
+        self._backend = backend
+        self.backendName = backend.name()
+        qclass.backendSizes[self.backendName] = backend.configuration().n_qubits #Backends sharing a name may differ in size
 
-    def run(self):
+
+    @property
+    def layout(self):
+        """
+        Maps each qubit that was allotted or used onto a dense
+        index in the emitted register
+        With a coupling map every qubit keeps its physical index
+        """
+        if self.topology is not None:
+            return {q: q for q in range(self.size)}
+        used = set(range(self.qubitAllocator.highWater))
+        for instruction in self.instructions:
+            used.update(instruction.qubits)
+        return {q: i for i, q in enumerate(sorted(used))}
+
+    def compact(self, instructions= None):
+        """
+        Returns the instructions (defaults to every recorded instruction)
+        renumbered onto the dense layout along with the quantum and
+        classical register sizes they need
+        The classical register is sized to the high water mark of
+        chunk_class so counts keep the indices it handed out
+        """
+        if instructions is None:
+            instructions = self.instructions
+        layout = self.layout
+        classSize = self.classAllocator.highWater
+        compacted = []
+        for name, qubits, clbits, params in instructions:
+            if clbits:
+                classSize = max(classSize, max(clbits) + 1)
+            compacted.append(qop(name, tuple(layout[q] for q in qubits), clbits, params))
+        return compacted, max(len(layout), 1), max(classSize, 1)
+
+    def to_circuit(self, instructions= None):
+        """
+        Lowers the instructions (defaults to every recorded instruction)
+        directly to a qiskit QuantumCircuit
+        Registers are only as wide as the qubits and classical bits used
+        """
+        from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister
+        instructions, quantSize, classSize = self.compact(instructions)
+        q = QuantumRegister(quantSize, 'q')
+        c = ClassicalRegister(classSize, 'c')
+        circuit = QuantumCircuit(q, c)
+        for name, qubits, clbits, params in instructions:
+            if name == "measure":
+                circuit.measure(q[qubits[0]], c[clbits[0]])
+            elif name == "mct":
+                for gate, gateQubits, gateClbits, gateParams in self.decompose_mct(qubits, params[0]):
+                    getattr(circuit, gate)(*gateParams, *[q[i] for i in gateQubits])
+            else:
+                params = [self._parameter(p) if isinstance(p, qexpr) else p for p in params]
+                getattr(circuit, name)(*params, *[q[i] for i in qubits])
+        return circuit
+
+    def _parameter(self, expression: qexpr):
+        """
+        Returns the qiskit Parameter standing in for a qexpr
+        """
+        if expression not in self.parameters:
+            from qiskit.circuit import Parameter
+            self.parameters[expression] = Parameter(expression.label)
+        return self.parameters[expression]
+
+    def qasm(self):
+        """
+        Serializes the recorded instructions to an OpenQASM string
+        """
+        return self.to_circuit().qasm()
+
+    def save_qasm(self, path= None):
+        """
+        Writes the OpenQASM for the circuit to path
+        (defaults to qasmDir) and returns the path written
+        """
+        if path is None:
+            path = self.qasmDir
+        with open(path, 'w') as output:
+            output.write(self.qasm())
+        return path
+
+    def optimized(self):
+        """
+        Returns the recorded instructions after the peephole passes
+        and stores the before and after gate counts and depth in optimizationReport
+        """
+        instructions, self.optimizationReport = qoptimizer.optimize(self.instructions)
+        return instructions
+
+    def run(self, shots= 1024, memory= False, optimize= True, seed= None):
         """
         Runs the compiled circuit
         returns a qiskit results object
         Use get_result to get a single result
+        Set memory to keep the result of every shot
+        Unless optimize is False redundant gates are removed first
+        seed defaults to the seed the qclass was made with
+        With localFastPath set a remote simulator may be replaced by qsim,
+        in which case the job and result are qsim's rather than qiskit's
         """
-        self.output.close()
-        self.circuit = QuantumCircuit.from_qasm_file(self.qasmDir)
+        if seed is None:
+            seed = self.seed
         self.collapsed = True
-        return execute(self.circuit, backend= self.backend)
+        backend = self._run_backend()
+        self.circuit = self._experiment(backend, optimize)
+        self.engine = backend.engine(self.circuit[0]) if isinstance(backend, qsim) else backend.name()
+        return self._submit(backend, self.circuit, shots= shots, memory= memory, seed= seed)
+
+    def _run_backend(self):
+        """
+        Returns the backend to run the circuit on
+        When localFastPath is set a remote simulator is swapped for qsim when the circuit never leaves
+        the computational basis, which qsim evaluates with integer bit operations,
+        or is all Clifford gates, which qsim samples from a stabilizer tableau
+        Both work whatever the width of the circuit
+        """
+        backend = self.backend
+        if not self.localFastPath or isinstance(backend, qsim) or not getattr(backend.configuration(), "simulator", False):
+            return backend
+        if qsim.engine(self.instructions) != "statevector":
+            return qsim(n_qubits= self.size, seed= self.seed)
+        return backend
+
+    def _experiment(self, backend, optimize= True):
+        """
+        Lowers the instructions to what backend runs
+        """
+        instructions = self.optimized() if optimize else self.instructions
+        if any(is_symbolic(instruction.params) for instruction in instructions):
+            raise ValueError("The circuit has qparams so it must be run with run_bindings")
+        if isinstance(backend, qsim):
+            return self.compact(instructions)
+        return self._transpiled(instructions, backend)
+
+    def _transpiled(self, instructions, backend):
+        """
+        Returns the instructions lowered and transpiled for backend
+        Reuses the cached transpilation of any circuit with the same structure
+        for a backend with the same basis gates and coupling map
+        """
+        from qiskit import transpile
+        configuration = backend.configuration()
+        #Placed chunks only pay off if the transpiler keeps virtual qubit i on physical qubit i
+        initialLayout = list(range(self.size)) if self.topology is not None else None
+        key = qcache.digest(self.compact(instructions), backend.name(), getattr(configuration, "basis_gates", None),
+                            getattr(configuration, "coupling_map", None), self.optimizationLevel, initialLayout)
+        cache = qclass.transpileCache
+        circuit = cache.get(key) if cache is not None else None
+        if circuit is None:
+            circuit = transpile(self.to_circuit(instructions), backend= backend, optimization_level= self.optimizationLevel,
+                                initial_layout= initialLayout)
+            if cache is not None:
+                cache.put(key, circuit)
+        return circuit
+
+    @staticmethod
+    def _submit(backend, experiments, shots= 1024, memory= False, seed= None, parameterBinds= None):
+        """
+        Submits one or a list of lowered experiments as a single job
+        qiskit experiments must already be transpiled for backend
+        """
+        if isinstance(backend, qsim):
+            return backend.run(experiments, shots= shots, memory= memory, seed= seed)
+        from qiskit import assemble
+        qobj = assemble(experiments, backend= backend, shots= shots, memory= memory, seed_simulator= seed,
+                        parameter_binds= parameterBinds)
+        return backend.run(qobj)
+
+    def run_bindings(self, bindings: list, shots= 1024, optimize= True):
+        """
+        Runs the circuit once for each dict of qparam names to values
+        in bindings as a single job and returns a list of counts in order
+        On qiskit backends the circuit is lowered and transpiled once with
+        symbolic parameters (or taken from transpileCache), qsim runs each
+        bound circuit directly
+        """
+        if not bindings:
+            raise ValueError("run_bindings needs at least one binding")
+        self.collapsed = True
+        backend = self.backend
+        if isinstance(backend, qsim):
+            experiments = []
+            for values in bindings:
+                bound = bind(self.instructions, values)
+                if optimize:
+                    bound = qoptimizer.optimize(bound)[0]
+                experiments.append(self.compact(bound))
+            result = self._submit(backend, experiments, shots= shots, seed= self.seed).result()
+        else:
+            instructions = self.optimized() if optimize else self.instructions
+            circuit = self._transpiled(instructions, backend)
+            #A cached circuit has its own Parameter objects so match them by name
+            expressions = {p.label: p for instruction in instructions for p in instruction.params if isinstance(p, qexpr)}
+            binds = [{parameter: expressions[parameter.name].evaluate(values) for parameter in circuit.parameters}
+                     for values in bindings]
+            result = self._submit(backend, circuit, shots= shots, seed= self.seed, parameterBinds= binds).result()
+        return [result.get_counts(i) for i in range(len(bindings))]
+
+    @staticmethod
+    def run_batch(programs: list, backend= None, optimize= True):
+        """
+        Runs the circuits of several qclasses as a single job
+        on backend (defaults to the backend of the first qclass)
+        The counts of each circuit are stored on the qclass it came from
+        so get_counts and get_result return them without running again
+        Returns the job
+        """
+        if not programs:
+            raise ValueError("run_batch needs at least one qclass")
+        if backend is None:
+            backend = programs[0].backend
+        experiments = []
+        for program in programs:
+            program.collapsed = True
+            program.circuit = program._experiment(backend, optimize)
+            experiments.append(program.circuit)
+        job = qclass._submit(backend, experiments)
+        result = job.result()
+        for i, program in enumerate(programs):
+            program.counts = result.get_counts(i)
+        return job
     
     def get_result(self):
         """
@@ -134,49 +512,135 @@ class qclass(object):
         the most times during runs
         randomly breaking ties
         """
-        result = self.run()
-        counts = result.result().get_counts()
+        counts = self.get_counts()
         maxVal = max(counts.values())
         choices = [x for x, y in counts.items() if y == maxVal]
         return random.choice(choices)[::-1] #Reverse the string so that the index matches that assigned by chunk 
 
+    def get_probabilities(self, *registers, values= None):
+        """
+        Returns exact probabilities from one statevector simulation
+        of the circuit with its measurements removed
+        Without registers the keys are classical register bitstrings as in
+        get_counts, otherwise they are register values as in extract_counts
+        Registers are read from their qubits so they need not be measured
+        Every measurement must come after the last gate on its qubit
+        A circuit with qparams needs values, a dict of their names to values
+        """
+        instructions = self.instructions if values is None else bind(self.instructions, values)
+        if any(is_symbolic(instruction.params) for instruction in instructions):
+            raise ValueError("The circuit has qparams so values must be given for them")
+        unitary = []
+        measured = {} #classical bit -> qubit measured into it
+        measuredQubits = set()
+        for instruction in instructions:
+            if instruction.name == "measure":
+                measured[instruction.clbits[0]] = instruction.qubits[0]
+                measuredQubits.add(instruction.qubits[0])
+            elif instruction.name == "reset" or measuredQubits.intersection(instruction.qubits):
+                raise ValueError("Exact probabilities need every measurement to come after the last gate on its qubit")
+            else:
+                unitary.append(instruction)
+        simulator = self._backend if isinstance(self._backend, qsim) else qsim()
+        unitary = qoptimizer.cancel_adjacent(unitary)
+        if registers:
+            bitLists = [[register.qubit] if hasattr(register, "qubit") else list(register.qubits) for register in registers]
+            toReturn = {}
+            for row, prob in simulator.marginals(unitary, bitLists).items():
+                key = tuple(register._from_int(value) for register, value in zip(registers, row))
+                toReturn[key if len(registers) > 1 else key[0]] = prob
+            return toReturn
+        classSize = max(self.classAllocator.highWater, max(measured, default= -1) + 1, 1) #Sized like compact
+        bits = [measured.get(c) for c in range(classSize)]
+        return {format(row[0], '0%db' % classSize): prob for row, prob in simulator.marginals(unitary, [bits]).items()}
+
+    def get_result_adaptive(self, confidence= 0.99, batch= 128, maxShots= 8192):
+        """
+        Runs the circuit in batches of batch shots until the most frequent
+        result beats the runner up at the given confidence or maxShots is spent
+        The confidence is one minus the p-value of a one sided binomial test
+        of the leader against the runner up over the shots landing on either,
+        Bonferroni corrected for the ceil(maxShots/batch) times it may be checked
+        so stopping early on a tie happens at most 1 - confidence of the time
+        Returns the result (indexed like get_result), its confidence and the shots used
+        """
+        backend = self._run_backend()
+        experiment = self._experiment(backend)
+        self.engine = backend.engine(experiment[0]) if isinstance(backend, qsim) else backend.name()
+        self.collapsed = True
+        counts = {}
+        shots = 0
+        reached = 0.0
+        checks = math.ceil(maxShots/batch)
+        while shots < maxShots:
+            shotsNow = min(batch, maxShots - shots)
+            seed = None if self.seed is None else self.seed + shots #Every batch needs fresh samples
+            for key, count in self._submit(backend, experiment, shots= shotsNow, seed= seed).result().get_counts().items():
+                key = key.replace(' ', '')
+                counts[key] = counts.get(key, 0) + count
+            shots += shotsNow
+            ranked = sorted(counts.values(), reverse= True) + [0]
+            reached = 1 - min(1.0, checks*_binomial_tail(ranked[0], ranked[0] + ranked[1]))
+            if reached >= confidence:
+                break
+        self.counts = counts
+        maxVal = max(counts.values())
+        choices = [x for x, y in counts.items() if y == maxVal]
+        return random.choice(choices)[::-1], reached, shots
+
     def ccx(self, a: int, b: int, c: int):
         """
         Applies the ccx gate with a and b as control qubits
         and c as the bit to be flipped
         """
-        self.write("ccx q[%d]," % a, + " q[%d]," % b + " q[%d]; \n" % c)
+        self.append("ccx", (a, b, c))
 
     def cx(self, a: int, b: int):
         """
         Applies the controled bit flip
         gate to b using a as a control qubit
         """
-        self.write("cx q[%d]," % a + " q[%d]; \n" % b)
+        self.append("cx", (a, b))
 
     def ugate(self, gate, a: int):
         """
         Applies a unary gate represented by a string
         to qubit a
         """
-        self.write(gate + " q[%d]; \n" % a)
+        self.append(gate, (a,))
+
+    def measure(self, qubit: int, classBit: int):
+        """
+        Measures a qubit into a classical bit
+        The qubit can not be returned until it is reset
+        """
+        self.append("measure", (qubit,), (classBit,))
+        self.qubitAllocator.mark_dirty([qubit])
 
-    def request_chunk(self, size: int):
+    def reset(self, qubit: int):
+        """
+        Returns a qubit to |0> mid circuit
+        """
+        self.append("reset", (qubit,))
+        self.qubitAllocator.mark_clean([qubit])
+
+    def scope(self):
+        """
+        Returns a qscope whose gates are undone when the with block exits
+        so the temporary qubits it allocated go back to the allocator
+        Use scope.keep on the registers whose values should survive
+        """
+        return qscope(self)
+
+    def request_chunk(self, size: int, near= ()):
         """
         Checkes if enough available qubits exist to 
         serve a chunk and returns the bits if so or False
         if not
+        With a coupling map the qubits are placed close to near
         """
-        if size <= 0:
-            return []
-        if size > self.bitsLeft:
-            return False
-        else:
-            toReturn = []
-            while len(toReturn) < size:
-                toReturn.append(self._nextQubit)
-                self._nextQubit = self._availableQubits.pop()
-        return toReturn
+        chunk = self.qubitAllocator.request(size, near)
+        return self._shadow(chunk) if chunk else chunk
 
     def mct(self, control: list, target: int, ancillary= []):
         """
@@ -184,61 +648,191 @@ class qclass(object):
         of qubits
         """
         if not ancillary:
-            q = QuantumRegister(len(control) + 1)
-            qc = QuantumCircuit(q)
-            controls = [q[i] for i in range(len(control))]
-            qc.mct(controls, q[len(controls)], None, mode='noancilla')
-            toWrite = qc.qasm()
-            qreg = toWrite.index("qreg ") + 5
-            regI = toWrite[qreg:toWrite.index("]", start=qreg)]
-            toWrite.replace(regI, 'q')
-            for i in range(len(control)):
-                toWrite.replace('q[' + i + ']', 'q[' + control[i] + ']')
-            toWrite.replace('q[' + len(control) + ']', 'q[' + target + ']')
-        else:
-            q = QuantumRegister(len(control) + len(ancillary) + 1)
-            qc = QuantumCircuit(q)
-            controls = [q[i] for i in range(len(control))]
-            ancillaries = [q[i + len(control)] for i in range(len(ancillary))]
-            qc.mct(controls, q[len(controls) + len(ancillaries)], ancillaries, mode='basic')
-            toWrite = qc.qasm()
-            qreg = toWrite.index("qreg ") + 5
-            regI = toWrite[qreg:toWrite.index("]", start=qreg)]
-            toWrite.replace(regI, 'q')
-            for i in range(len(control)):
-                toWrite.replace('q[' + i + ']', 'q[' + control[i] + ']')
-            for i in range(len(ancillary)):
-                currentI = i + len(control)
-                toWrite.replace('q[' + currentI + ']', 'q[' + ancillary[i] + ']')
-            toWrite.replace('q[' + (len(control) + len(ancillary)) + ']', 'q[' + target + ']')
-        toWrite = toWrite[toWrite.index("h q["):]
-        self.write(toWrite)
+            ancillary = []
+        self.append("mct", list(control) + list(ancillary) + [target], params=(len(control),))
+
+    @staticmethod
+    def decompose_mct(qubits, numControls: int):
+        """
+        Returns the gates an mct instruction on qubits expands to
+        Decompositions are cached per shape and only remapped onto qubits
+        """
+        template = _mct_template(numControls, len(qubits) - numControls - 1)
+        return [qop(gate, tuple(qubits[slot] for slot in slots), (), params) for gate, slots, params in template]
+
+    @staticmethod
+    def mct_cache_info():
+        """
+        Returns the hits, misses, maxsize and currsize of the mct decomposition cache
+        """
+        return _mct_template.cache_info()
 
     def q_prob(self, target: int, prob: float):
         """
         Places a qubit in a state that has a 
         probability of prob of observing a 1
         Assumes the qubit begins in a |"0"> state
+        prob may be a qparam
         """
+        if isinstance(prob, qparam):
+            self.append("rx", (target,), params=(prob.angle(),))
+            return
         theta = math.asin(math.sqrt(prob))
-        self.write("rx(%d) " % 2*theta + "q[%d]; \n" % target)
+        self.append("rx", (target,), params=(2*theta,))
 
     def cprob(self, control: int, target: int, prob: float):
         """
         Places a qubit into a probability if the control gate 
         Assumes the target begins in a |"0"> state
+        prob may be a qparam
         """
-        theta = math.asin(math.sqrt(prob))
+        angle = prob.angle() if isinstance(prob, qparam) else 2*math.asin(math.sqrt(prob))
         self.ugate("h", target)
-        self.write("crz(%d) " % 2*theta + "q[%d] " % control + "q[%d]; \n" % target)
+        self.append("crz", (control, target), params=(angle,))
         self.ugate("h", target)
 
     def get_counts(self):
         """
         Returns the counts for each result
+        Counts already stored by a previous run or run_batch
+        are reused as long as no gates were added since
         """
-        result = self.run()
-        counts = result.result().get_counts()
+        if self.counts is None:
+            self._fetch_counts()
+        return self.counts
+
+    def cache_key(self, shots= 1024):
+        """
+        Returns the key results of this circuit are cached under
+        A hash of the optimized circuit, backend name, shot count and seed
+        """
+        instructions, quantSize, classSize = self.compact(self.optimized())
+        return qcache.digest(instructions, quantSize, classSize, self.backendName, shots, self.seed)
+
+    def _fetch_counts(self):
+        """
+        Gets the counts from the cache or else runs the circuit
+        Stores them on the qclass and returns them
+        """
+        key = None
+        if self.cache is not None:
+            key = self.cache_key()
+            counts = self.cache.get(key)
+            if counts is not None:
+                self.collapsed = True
+                self.counts = counts
+                return counts
+        counts = self.run().result().get_counts()
+        if key is not None:
+            self.cache.put(key, counts)
+        self.counts = counts
         return counts
 
+    @classmethod
+    def set_concurrency(cls, limit: int):
+        """
+        Sets the most jobs kept in flight at once by run_future and run_async
+        Jobs already submitted finish on the previous pool
+        """
+        if limit <= 0:
+            raise ValueError("limit must be a positive integer")
+        with cls._executorLock:
+            cls.concurrency = limit
+            if cls._executor is not None:
+                cls._executor.shutdown(wait= False)
+                cls._executor = None
+
+    @classmethod
+    def _pool(cls):
+        """
+        Returns the thread pool jobs are waited on in
+        """
+        with cls._executorLock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(max_workers= cls.concurrency)
+            return cls._executor
+
+    def _run_blocking(self, shots: int, memory: bool, optimize: bool):
+        """
+        Runs the circuit, waits for it and stores its counts
+        """
+        result = self.run(shots= shots, memory= memory, optimize= optimize).result()
+        self.counts = result.get_counts()
+        return result
+
+    def run_future(self, shots= 1024, memory= False, optimize= True):
+        """
+        Submits the circuit without blocking
+        Returns a concurrent.futures.Future of the qiskit result
+        """
+        return self._pool().submit(self._run_blocking, shots, memory, optimize)
+
+    def get_counts_future(self):
+        """
+        Returns a concurrent.futures.Future of the counts for each result
+        """
+        if self.counts is not None:
+            future = Future()
+            future.set_result(self.counts)
+            return future
+        return self._pool().submit(self._fetch_counts)
+
+    async def run_async(self, shots= 1024, memory= False, optimize= True):
+        """
+        Coroutine that runs the circuit and returns the qiskit result
+        """
+        return await asyncio.wrap_future(self.run_future(shots= shots, memory= memory, optimize= optimize))
+
+    async def get_counts_async(self):
+        """
+        Coroutine that returns the counts for each result
+        """
+        return await asyncio.wrap_future(self.get_counts_future())
+
+    @staticmethod
+    def _outcomes(counts: dict):
+        """
+        Converts a counts dict to an array of outcomes
+        as integers and an array of their counts
+        """
+        keys = [key.replace(' ', '') for key in counts.keys()]
+        if max(len(key) for key in keys) <= 64:
+            outcomes = np.fromiter((int(key, 2) for key in keys), dtype= np.uint64, count= len(keys))
+        else:
+            #Too wide for uint64 so fall back on python ints
+            outcomes = np.array([int(key, 2) for key in keys], dtype= object)
+        return outcomes, np.fromiter(counts.values(), dtype= np.int64, count= len(keys))
+
+    def extract_counts(self, counts: dict, *registers):
+        """
+        Returns the distribution of the values measured into one or more
+        registers (anything with classBits, such as a measured qint or qbool)
+        A single register gives a dict of value to count and several give
+        a dict of tuples of values (in the order given) to count
+        """
+        if not registers:
+            raise ValueError("extract_counts needs at least one register")
+        outcomes, weights = self._outcomes(counts)
+        one = outcomes.dtype.type(1)
+        columns = []
+        for register in registers:
+            values = np.zeros_like(outcomes)
+            for i, classBit in enumerate(register.classBits):
+                values |= ((outcomes >> outcomes.dtype.type(classBit)) & one) << outcomes.dtype.type(i)
+            columns.append(values)
+        if outcomes.dtype == object:
+            joint = {}
+            for row, weight in zip(zip(*columns), weights.tolist()):
+                joint[row] = joint.get(row, 0) + weight
+            rows, totals = list(joint.keys()), list(joint.values())
+        else:
+            unique, inverse = np.unique(np.stack(columns, axis= 1), axis= 0, return_inverse= True)
+            totals = np.bincount(inverse.reshape(-1), weights= weights, minlength= len(unique)).astype(np.int64).tolist()
+            rows = unique.tolist()
+        toReturn = {}
+        for row, total in zip(rows, totals):
+            key = tuple(register._from_int(int(value)) for register, value in zip(registers, row))
+            toReturn[key if len(registers) > 1 else key[0]] = total
+        return toReturn
+
         
\ No newline at end of file
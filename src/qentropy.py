@@ -0,0 +1,126 @@
+from __future__ import annotations
+from qclass import qclass
+import threading
+
+class qentropy(object):
+    """
+    Buffered pool of quantum random bits
+    One job of a Hadamard circuit run with many shots
+    serves many random numbers and the pool refills in the
+    background once it runs low
+    """
+    _shared = {} #backend name -> pool used by qint.quantrand
+
+    def __init__(self, backend= None, width= None, shots= 8192, lowWater= None):
+        """
+        backend is anything qclass accepts as a backend
+        width is the number of qubits put in superposition for each shot
+        A background refill starts once fewer than lowWater bits are left
+        """
+        self.backend = backend
+        self.shots = shots
+        self._width = width
+        self.lowWater = lowWater
+        self.jobs = 0
+        self._bits = ''
+        self._pos = 0
+        self._lock = threading.Lock() #Guards the buffer
+        self._refillLock = threading.Lock() #Lets one refill run at a time
+        self._refiller = None
+
+    @classmethod
+    def shared(cls, backend):
+        """
+        Returns the pool shared by every caller of the named backend
+        """
+        if backend not in cls._shared:
+            cls._shared[backend] = cls(backend= backend)
+        return cls._shared[backend]
+
+    @property
+    def available(self):
+        """
+        The number of buffered bits not yet handed out
+        """
+        return len(self._bits) - self._pos
+
+    def _sample(self):
+        """
+        Runs the Hadamard circuit and returns its raw bits as a string
+        """
+        thisQclass = qclass(backend= self.backend)
+        thisQclass.start()
+        width = self._width
+        if width is None:
+            #14 qubits covers the largest range quantrand accepts in a single draw
+            width = min(thisQclass.size, 14)
+        qubits = thisQclass.chunk(width)
+        classBits = thisQclass.chunk_class(width)
+        for qubit, classBit in zip(qubits, classBits):
+            thisQclass.ugate("h", qubit)
+            thisQclass.measure(qubit, classBit)
+        memory = thisQclass.run(shots= self.shots, memory= True).result().get_memory()
+        self.jobs += 1
+        if self.lowWater is None:
+            self.lowWater = (width*self.shots)//4
+        return ''.join(memory).replace(' ', '')
+
+    def _refill(self, needed: int):
+        """
+        Adds one job worth of bits to the pool unless it already holds needed bits
+        Refills run one at a time so threads that find the pool short
+        together wait on a single job
+        """
+        with self._refillLock:
+            with self._lock:
+                if self.available >= needed:
+                    return
+            bits = self._sample()
+            with self._lock:
+                self._bits = self._bits[self._pos:] + bits
+                self._pos = 0
+
+    def _refill_quietly(self):
+        try:
+            self._refill(self.lowWater)
+        except Exception:
+            pass #The next getbits that runs short refills again and raises if that fails too
+
+    def _refill_background(self):
+        """
+        Starts a refill thread unless one is already running
+        """
+        if self._refiller is None or not self._refiller.is_alive():
+            self._refiller = threading.Thread(target= self._refill_quietly, daemon= True)
+            self._refiller.start()
+
+    def getbits(self, bits: int):
+        """
+        Returns an int made of the next bits random bits
+        Blocks on a refill if the pool does not hold enough
+        and raises whatever that refill raised
+        """
+        if bits <= 0:
+            return 0
+        while True:
+            with self._lock:
+                if self.available >= bits:
+                    val = int(self._bits[self._pos:self._pos + bits], 2)
+                    self._pos += bits
+                    if self.available < self.lowWater:
+                        self._refill_background()
+                    return val
+            self._refill(bits)
+
+    def randbelow(self, n: int):
+        """
+        Returns a uniformly random int in [0, n)
+        Draws are rejected and redrawn from the pool when they land outside the range
+        """
+        if n <= 0:
+            raise ValueError("n must be a positive integer")
+        bits = (n - 1).bit_length()
+        while True:
+            val = self.getbits(bits)
+            if val < n:
+                return val
@@ -1,6 +1,10 @@
 from __future__ import annotations
 from qclass import qclass
+from qmetrics import instrumented
+from qparam import qparam
+from qentropy import qentropy
 import math
+from collections import Counter
 from warnings import warn
 
 class qint(object):
@@ -8,24 +12,36 @@ class qint(object):
     Quantum integer class
     """
     def __init__(self, qclass, value= 0, size=None, small=False, big=False):
+        """
+        value may be a qparam to build a template
+        that is run with qclass.run_bindings, size is then required
+        """
         self.qclass = qclass
         self.initial = value
         self.big = big
         self.small = small
         self.firstQubit = None #The qubit that should be measured first if applicable
+        self.classBits = None
+        if isinstance(value, qparam):
+            if not size:
+                raise ValueError("A qint with a qparam value needs a size")
+            self.qubits = self.qclass.chunk(size)
+            with self.qclass.metrics.track("qint.__init__"):
+                for i, qubit in enumerate(self.qubits):
+                    self.qclass.append("rx", (qubit,), params= (value.bit(i),))
+            return
         if not size:
             self.qubits = self.smart_chunk()
         else:
             self.qubits = self.qclass.chunk(size)
         strInit = str(bin(self.initial))[2:]
         strInit = strInit[::-1]
-        toWrite = ''
-        i = 0
-        while i < len(strInit):
-            if strInit[i] == '1':
-                toWrite += "x q[%d]; \n" % self.qubits[i]
-            i += 1
-        self.qclass.write(toWrite)
+        with self.qclass.metrics.track("qint.__init__"):
+            i = 0
+            while i < len(strInit):
+                if strInit[i] == '1':
+                    self.qclass.ugate("x", self.qubits[i])
+                i += 1
 
     def smart_chunk(self):
         """
@@ -86,6 +102,7 @@ class qint(object):
         else:
             return maxBits
 
+    @instrumented
     def all_vals(self):
         """
         When called on a pure int places the qint into
@@ -93,18 +110,31 @@ class qint(object):
         Applies an h gate to all qubits
         """
         for i in range(len(self.qubits)):
-            self.qclass.write("h q[%d]; \n" % self.qubits[i])
+            self.qclass.ugate("h", self.qubits[i])
         
-    def measure(self):
+    @instrumented
+    def measure(self, reset= False):
         """
         Measures the stored qint
         returning the list of indices of 
         classical bits the measurements are stored in
+        With reset the qubits are reset and returned to the qclass
+        for reuse so the qint can not be used in gates afterwards
         """
         self.qclass.collapsed = True
         self.classBits = self.qclass.chunk_class(len(self.qubits))
         for i in range(len(self.classBits)):
-            self.qclass.write("measure q[%d] " % self.qubits[i] + "-> c[%d]; \n" % self.classBits[i])
+            self.qclass.measure(self.qubits[i], self.classBits[i])
+        if reset:
+            self._release()
+
+    def _release(self):
+        """
+        Resets the measured qubits and returns them to the qclass
+        """
+        self.qclass.return_chunk(self.qubits)
+        self.qubits = []
+        self.firstQubit = None
 
     def extract_result(self, result):
         """
@@ -117,12 +147,141 @@ class qint(object):
         val = int(binaryStr, 2)
         return val
 
+    @staticmethod
+    def _ripple_carry(a: list, b: list, carry: int):
+        """
+        Returns the gates of a Cuccaro ripple carry adder
+        computing b += a mod 2^len(b) with a and the carry left unchanged
+        The carry qubit must start in |0>, every gate is its own inverse
+        """
+        def maj(c, y, x):
+            return [("cx", (x, y)), ("cx", (x, c)), ("ccx", (c, y, x))]
+        def uma(c, y, x):
+            return [("ccx", (c, y, x)), ("cx", (x, c)), ("cx", (c, y))]
+        gates = maj(carry, b[0], a[0])
+        for i in range(1, len(b)):
+            gates += maj(a[i-1], b[i], a[i])
+        for i in range(len(b) - 1, 0, -1):
+            gates += uma(a[i-1], b[i], a[i])
+        gates += uma(carry, b[0], a[0])
+        return gates
+
+    def _add_qubits(self, a: list, subtract= False):
+        """
+        Adds (or subtracts) the value held on the qubits a in place
+        Pads a with clean ancillas when it is shorter than the qint
+        """
+        if set(a) & set(self.qubits):
+            raise ValueError("Can not add a qint to itself in place")
+        size = len(self.qubits)
+        padding = self.qclass.request_chunk(max(size - len(a), 0) + 1, near= self.qubits)
+        if padding is False:
+            raise OverflowError("Insufficient qubits for the adder's ancillas")
+        a = list(a[:size]) + padding[:-1]
+        gates = self._ripple_carry(a, self.qubits, padding[-1])
+        if subtract:
+            gates.reverse()
+        for name, qubits in gates:
+            self.qclass.append(name, qubits)
+        self.qclass.return_chunk(padding)
+
+    @instrumented
+    def add(self, other: qint):
+        """
+        Adds another qint to this one in place modulo 2^size
+        other is left unchanged
+        Uses a linear size ripple carry adder with one carry ancilla
+        """
+        self._add_qubits(other.qubits)
+
+    @instrumented
+    def sub(self, other: qint):
+        """
+        Subtracts another qint from this one in place modulo 2^size
+        other is left unchanged
+        """
+        self._add_qubits(other.qubits, subtract= True)
+
+    @staticmethod
+    def _constant_adder(b: list, value: int, carries: list):
+        """
+        Returns the gates of a ripple carry adder computing b += value mod 2^len(b)
+        with the classical value folded in, so no qubits hold the constant
+        Each carry is the and (bit of value 0) or the or (bit 1) of the bit below and its carry
+        Below the lowest set bit of value every carry is 0 and the one above it is that bit of b
+        so carries needs len(b) - low - 2 qubits in |0>, which are returned to |0>
+        """
+        low = (value & -value).bit_length() - 1
+        carry = {low + 1: b[low]} if low + 1 < len(b) else {}
+        carry.update(zip(range(low + 2, len(b)), carries))
+        def compute(i):
+            #Flips carry i + 1 by the carry out of bit i, applying it twice undoes it
+            if (value >> i) & 1:
+                flips = [("x", (b[i],)), ("x", (carry[i],))]
+                return flips + [("ccx", (b[i], carry[i], carry[i + 1])), ("x", (carry[i + 1],))] + flips
+            return [("ccx", (b[i], carry[i], carry[i + 1]))]
+        gates = []
+        for i in range(low + 1, len(b) - 1):
+            gates += compute(i)
+        #Sum from the top down so the bits below still hold what their carries were computed from
+        for i in range(len(b) - 1, low - 1, -1):
+            if i in carry:
+                gates.append(("cx", (carry[i], b[i])))
+            if (value >> i) & 1:
+                gates.append(("x", (b[i],)))
+            if i >= low + 2:
+                gates += compute(i - 1)
+        return gates
+
+    @instrumented
+    def add_const(self, value: int):
+        """
+        Adds a classical constant to this qint in place modulo 2^size
+        Uses the ripple carry adder with the constant folded into its gates
+        """
+        value %= 2**len(self.qubits)
+        if value == 0:
+            return
+        low = (value & -value).bit_length() - 1
+        carries = []
+        if len(self.qubits) - low > 2:
+            carries = self.qclass.request_chunk(len(self.qubits) - low - 2, near= self.qubits)
+            if carries is False:
+                raise OverflowError("Insufficient qubits for the adder's carries")
+        for name, qubits in self._constant_adder(self.qubits, value, carries):
+            self.qclass.append(name, qubits)
+        if carries:
+            self.qclass.return_chunk(carries)
+
+    @instrumented
+    def sub_const(self, value: int):
+        """
+        Subtracts a classical constant from this qint in place modulo 2^size
+        """
+        self.add_const(-value)
+
+    @instrumented
     def increment(self):
         """
         Increments a qint
+        From 6 qubits up with enough free qubits this adds 1 with the
+        ripple carry adder, which needs fewer two qubit gates than
+        the cascade of mct gates used below that
+        Backends that apply mct natively keep the cascade, which
+        unlike the adder's carries touches no extra qubits
+        """
+        if len(self.qubits) > 5 and not self.qclass.nativeMct and self.qclass.bitsLeft >= len(self.qubits) - 2:
+            self.add_const(1)
+        else:
+            self._increment_cascade()
+
+    def _increment_cascade(self):
+        """
+        Increments a qint with a cascade of mct gates
+        flipping each bit when every bit below it is 1
         """
         if len(self.qubits) > 3:
-            ancqubits = self.qclass.request_chunk(len(self.qubits)-2)
+            ancqubits = self.qclass.request_chunk(len(self.qubits)-2, near= self.qubits)
             if ancqubits:
                 i = len(self.qubits) - 1
                 while i > 2:
@@ -150,15 +309,17 @@ class qint(object):
             raise ValueError("Can not increment qint which has no qubits (Did you accidently make size=0?)")
 
     @classmethod
-    def quantrand(cls, start, stop, step=1, simulator= False):
+    def quantrand(cls, start, stop, step=1, simulator= False, pool= None):
         """
         Returns a random quantum integer within the 
         range [start, stop). Utilizes the smallest 
         possible quantum backend unless simulator is set
         to be true
+        Bits are drawn from a shared qentropy pool for the backend
+        so most calls never submit a job, pass pool to use another
         """
-        while True:
-            randRange = int(math.ceil((stop - start)/step))
+        randRange = int(math.ceil((stop - start)/step))
+        if pool is None:
             if simulator:
                 backend = "ibmq_qasm_simulator"
             else:
@@ -169,91 +330,82 @@ class qint(object):
                     backend = "ibmq_16_melbourne"
                 else:
                     backend = "ibmqx4"
-            thisQclass = qclass(backend= backend)
-            thisQclass.start()
-            thisSize = int(math.ceil(math.log(randRange, 2)))
-            thisInt = cls(thisQclass, size=thisSize)
-            thisInt.all_vals()
-            thisInt.measure()
-            result = thisQclass.get_result()
-            val = thisInt.extract_result(result)
-            val = (val + start) * step
-            if val < stop:
-                return val
-            else:
-                continue
+            pool = qentropy.shared(backend)
+        return start + pool.randbelow(randRange) * step
+
 
+    @staticmethod
+    def _prefix_trie(nums, size: int):
+        """
+        Counts the values sharing each prefix of low bits
+        trie[i][prefix] is how many values have prefix as their lowest i bits
+        """
+        trie = [Counter() for i in range(size + 1)]
+        for num in nums:
+            for i in range(size + 1):
+                trie[i][num & ((1 << i) - 1)] += 1
+        return trie
 
     @classmethod
     def super_position(cls, nums, qclass, size=None, small=False, big=False):
         """
         Returns a qint object which is a 
         superposition of each number
+        Qubits are prepared lowest bit first, each one rotated by the
+        probability of being 1 given the lower bits, which a prefix trie
+        of the values gives in one pass
         """
-        largest = max(nums)
-        size = cls.coerce_size(qclass, largest, small=small, big=big)
-        thisQint = cls(qclass, size=size)
-        bnums = [bin(x)[-1:2:-1] for x in nums]
-        tempChunk = qclass.chunk(1)
-        tempBit = tempChunk[0]
-        i = 1
-        prob = len([x for x in bnums if x[0] == '1'])/len(bnums)
-        thisQint.qclass.q_prob(thisQint[0], prob)
-        while i < len(bnums):
-            mem = []
-            if all([x[i] == '0' for x in bnums]):
-                #This state can be a pure 0 entangled to nothing
-                pass
-            elif all([x[i] == '1' for x in bnums]):
-                #This state can be a pure 1 entangled to nothing
-                thisQint.qclass.ugate("x", thisQint.qubits[i])
-            else:
-                #The state is not pure so we have to do some entangling
-                for k in range(i):
-                    thisQint.qclass.ugate("h", thisQint.qubits[k]) #Place all the previous qubits in a superposition
-                for strings in bnums:
-                    substring = strings[:i]
-                    if substring not in mem:
-                        mem.append(substring)
-                        toEntangle = [x for x in bnums if x.startswith(substring)] #All strings with the prefix
-                        if all([x[i] == '0' for x in toEntangle]):
-                            #We don't have to do anything here either
-                            pass
-                        elif all([x[i] == '1' for x in toEntangle]):
-                            #Controlled not this position
-                            for pos in range(len(substring)):
-                                if substring[pos] == '0':
-                                    thisQint.qclass.ugate('x', thisQint.qubits[pos])
-                            ancillary = thisQint.qclass.request_chunk(i-2)
-                            thisQint.qclass.mct(thisQint.qubits[:i], tempBit, ancillary = ancillary)
-                            thisQint.qclass.cx(tempBit, thisQint[i])
-                            thisQint.qclass.mct(thisQint.qubits[:i], tempBit, ancillary = ancillary)
-                            for pos in range(len(substring)):
-                                if substring[pos] == '0':
-                                    thisQint.qclass.ugate('x', thisQint.qubits[pos])
-                            if ancillary:
-                                qclass.return_chunk(ancillary)
-                        else:
-                            #Controlled q_prob at this position
-                            for pos in range(len(substring)):
-                                if substring[pos] == '0':
-                                    thisQint.qclass.ugate('x', thisQint.qubits[pos])
-                            prob = len([x for x in toEntangle if x[i] == '1'])/len(toEntangle) #Probability that this pos is 1 with the current substring
-                            ancillary = thisQint.qclass.request_chunk(i-2)
-                            thisQint.qclass.mct(thisQint.qubits[:i], tempBit, ancillary = ancillary)
-                            thisQint.qclass.cprob(tempBit, thisQint[i], prob)
-                            thisQint.qclass.mct(thisQint.qubits[:i], tempBit, ancillary = ancillary)
-                            for pos in range(len(substring)):
-                                if substring[pos] == '0':
-                                    thisQint.qclass.ugate('x', thisQint.qubits[pos])
-                            if ancillary:
-                                qclass.return_chunk(ancillary)
-                for k in range(i):
-                    thisQint.qclass.ugate("h", thisQint.qubits[k])
-            i += 1
-        thisQint.firstQubit = thisQint.qubits[0]
-        qclass.return_chunk(tempChunk)
+        with qclass.metrics.track("qint.super_position"):
+            largest = max(nums)
+            if size is None:
+                size = cls.coerce_size(qclass, largest, small=small, big=big)
+            elif largest >= 2**size:
+                raise OverflowError("%d is too large to fit in %d qubits" % (largest, size))
+            thisQint = cls(qclass, size=size)
+            trie = cls._prefix_trie(nums, size)
+            tempChunk = []
+            for i in range(size):
+                #Probability of this bit being 1 for every prefix of lower bits present
+                probs = {prefix: trie[i + 1].get(prefix | (1 << i), 0)/count for prefix, count in trie[i].items()}
+                distinct = set(probs.values())
+                if len(distinct) == 1:
+                    #The bit is independent of the lower bits so no entangling is needed
+                    prob = distinct.pop()
+                    if prob == 1:
+                        qclass.ugate("x", thisQint.qubits[i])
+                    elif prob > 0:
+                        qclass.q_prob(thisQint.qubits[i], prob)
+                    continue
+                if i > 1 and not tempChunk:
+                    tempChunk = qclass.chunk(1, near= thisQint.qubits)
+                for prefix, prob in probs.items():
+                    if prob == 0:
+                        continue
+                    zeros = [thisQint.qubits[k] for k in range(i) if not (prefix >> k) & 1]
+                    for qubit in zeros:
+                        qclass.ugate("x", qubit)
+                    if i == 1:
+                        control = thisQint.qubits[0]
+                    else:
+                        control = tempChunk[0]
+                        ancillary = qclass.request_chunk(i - 2, near= thisQint.qubits[:i])
+                        qclass.mct(thisQint.qubits[:i], control, ancillary= ancillary)
+                    if prob == 1:
+                        qclass.cx(control, thisQint.qubits[i])
+                    else:
+                        qclass.cprob(control, thisQint.qubits[i], prob)
+                    if i > 1:
+                        qclass.mct(thisQint.qubits[:i], control, ancillary= ancillary)
+                        if ancillary:
+                            qclass.return_chunk(ancillary)
+                    for qubit in zeros:
+                        qclass.ugate("x", qubit)
+            thisQint.firstQubit = thisQint.qubits[0]
+            if tempChunk:
+                qclass.return_chunk(tempChunk)
+            return thisQint
 
+    @instrumented
     def measure_sup(self):
         """
         Special measurement technique for insuring 
@@ -261,20 +413,34 @@ class qint(object):
         """
         self.measure_safe(self.firstQubit)
 
-    def measure_safe(self, first):
+    @instrumented
+    def measure_safe(self, first, reset= False):
         """
         Measures qints
         also warns the user if measurements on other qubits
         have already been made which may affect the current measurement
+        reset returns the qubits for reuse as in measure
         """
         if self.qclass.collapsed:
             warn("Warning: qubits on this qclass have collapsed if qubits were entangled it could effect measurements", RuntimeWarning)
         self.classBits = self.qclass.chunk_class(len(self.qubits))
         firstI = self.qubits.index(first)
-        self.qclass.write("measure q[%d] " % first + "-> c[%d]; \n" % self.classBits[firstI])
+        self.qclass.measure(first, self.classBits[firstI])
         for i in range(len(self.classBits)):
             if i != firstI:
-                self.qclass.write("measure q[%d] " % self.qubits[i] + "-> c[%d]; \n" % self.classBits[i])
+                self.qclass.measure(self.qubits[i], self.classBits[i])
+        if reset:
+            self._release()
+
+    def probabilities(self, values= None):
+        """
+        Returns the exact probability of each value the qint holds
+        from a statevector simulation, see qclass.get_probabilities
+        """
+        return self.qclass.get_probabilities(self, values= values)
+
+    def _from_int(self, value: int):
+        return value
 
     def extract_counts(self, counts: dict):
         """
@@ -282,11 +448,6 @@ class qint(object):
         returns a dict with the observed values as
         the keys and the counts as values
         """
-        toReturn = {}
-        for string, count in counts.items():
-            result = self.extract_result(string)
-            try:
-                toReturn[result] += count
-            except KeyError:
-                toReturn[result] = count
-        return toReturn
\ No newline at end of file
+        if self.classBits is None:
+            raise RuntimeError("qint was never measured so it can not be extracted")
+        return self.qclass.extract_counts(counts, self)
\ No newline at end of file
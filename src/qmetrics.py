@@ -0,0 +1,93 @@
+from __future__ import annotations
+from collections import Counter
+from functools import wraps
+from contextlib import contextmanager
+import json
+
+class qmetrics(object):
+    """
+    Live counters for the instructions a qclass records
+    Gates are attributed to the outermost instrumented qint or qbool
+    method on the call stack, or to "qclass" for direct calls
+    """
+    def __init__(self, hooks= None):
+        self.gates = Counter()
+        self.twoQubitGates = 0
+        self.byOperation = {} #operation -> Counter of gate names
+        self.calls = Counter() #operation -> number of top level calls
+        self._levels = {} #qubit -> depth of its last gate
+        self.depth = 0
+        self.stack = [] #Names of the instrumented methods currently running
+        self.hooks = hooks if hooks is not None else []
+
+    @property
+    def operation(self):
+        """
+        The operation new gates are attributed to
+        """
+        return self.stack[0] if self.stack else "qclass"
+
+    def record(self, instruction):
+        """
+        Updates the counters for one recorded instruction
+        and calls every hook with the instruction and operation
+        """
+        name = instruction.name
+        self.gates[name] += 1
+        if name != "mct" and len(instruction.qubits) == 2:
+            self.twoQubitGates += 1
+        level = max((self._levels.get(q, 0) for q in instruction.qubits), default= 0) + 1
+        for q in instruction.qubits:
+            self._levels[q] = level
+        self.depth = max(self.depth, level)
+        operation = self.operation
+        self.byOperation.setdefault(operation, Counter())[name] += 1
+        for hook in self.hooks:
+            hook(instruction, operation)
+
+    @contextmanager
+    def track(self, operation: str):
+        """
+        Attributes the gates recorded inside the with block to operation
+        unless an enclosing operation is already being tracked
+        """
+        if not self.stack:
+            self.calls[operation] += 1
+        self.stack.append(operation)
+        try:
+            yield
+        finally:
+            self.stack.pop()
+
+    def to_dict(self, allocator= None):
+        """
+        Returns the counters as a plain dict
+        Qubit usage is included when the qubit allocator is given
+        """
+        toReturn = {
+            "gates": dict(self.gates),
+            "total_gates": sum(self.gates.values()),
+            "two_qubit_gates": self.twoQubitGates,
+            "depth": self.depth,
+            "operations": {op: dict(gates) for op, gates in self.byOperation.items()},
+            "calls": dict(self.calls),
+        }
+        if allocator is not None:
+            toReturn["qubits_in_use"] = allocator.inUse
+            toReturn["peak_qubits"] = allocator.peak
+        return toReturn
+
+    def to_json(self, allocator= None):
+        return json.dumps(self.to_dict(allocator), sort_keys= True)
+
+
+def instrumented(method):
+    """
+    Decorator for qint and qbool methods that attributes the
+    gates recorded while the method runs to classname.method
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.qclass.metrics.track(type(self).__name__ + "." + method.__name__):
+            return method(self, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,153 @@
+from __future__ import annotations
+import math
+
+#Gates that undo themselves when applied twice to the same qubits
+_SELF_INVERSE = {"x", "y", "z", "h", "cx", "cy", "cz", "ch", "swap", "ccx", "mct", "id"}
+
+#Pairs of gates that undo each other
+_INVERSES = {"s": "sdg", "sdg": "s", "t": "tdg", "tdg": "t"}
+
+#Rotations that add their angles and the period after which they are the identity
+#Controlled rotations need 4pi since a 2pi rotation is -1 on the controlled subspace
+_ROTATIONS = {"rx": 4*math.pi, "ry": 4*math.pi, "rz": 4*math.pi, "crz": 4*math.pi, "u1": 2*math.pi, "cu1": 2*math.pi}
+
+#Gates whose control qubits may be listed in any order
+_SYMMETRIC_CONTROLS = {"ccx": 2, "cz": 2}
+
+#Gates whose adjoint is the same gate with the listed parameters negated and reordered
+_NEGATED = {"rx": (0,), "ry": (0,), "rz": (0,), "crz": (0,), "u1": (0,), "cu1": (0,), "u3": (0, 2, 1), "cu3": (0, 2, 1)}
+
+def _same_qubits(a, b):
+    """
+    Checks whether two gates of the same name act on the same qubits
+    """
+    if a.qubits == b.qubits:
+        return True
+    if a.name == "mct":
+        numControls = a.params[0]
+        return (a.params == b.params and set(a.qubits[:numControls]) == set(b.qubits[:numControls])
+                and a.qubits[numControls:] == b.qubits[numControls:])
+    if a.name in _SYMMETRIC_CONTROLS:
+        numControls = _SYMMETRIC_CONTROLS[a.name]
+        return set(a.qubits[:numControls]) == set(b.qubits[:numControls]) and a.qubits[numControls:] == b.qubits[numControls:]
+    return a.name == "swap" and set(a.qubits) == set(b.qubits)
+
+def _cancels(a, b):
+    """
+    Checks whether gate b directly after gate a is the identity
+    """
+    if a.name in _SELF_INVERSE and a.name == b.name:
+        return a.params == b.params and _same_qubits(a, b)
+    return _INVERSES.get(a.name) == b.name and a.qubits == b.qubits
+
+def depth(instructions):
+    """
+    Returns the depth of the instructions with every
+    gate on a qubit or classical bit taking one layer
+    """
+    levels = {}
+    maxLevel = 0
+    for instruction in instructions:
+        wires = [("q", q) for q in instruction.qubits] + [("c", c) for c in instruction.clbits]
+        level = max(levels.get(wire, 0) for wire in wires) + 1 if wires else 0
+        for wire in wires:
+            levels[wire] = level
+        maxLevel = max(maxLevel, level)
+    return maxLevel
+
+def cancel_adjacent(instructions):
+    """
+    Removes adjacent inverse pairs and merges adjacent rotations
+    Two gates are adjacent when nothing between them touches their qubits
+    Removing a pair may make the gates around it adjacent so cancellation cascades
+    """
+    kept = list(instructions)
+    alive = [True] * len(kept)
+    stacks = {} #qubit -> indices of the surviving gates on it in order
+    for i, instruction in enumerate(kept):
+        qubits = instruction.qubits
+        previous = None
+        if qubits and not instruction.clbits:
+            tops = set(stacks[q][-1] if stacks.get(q) else None for q in qubits)
+            if len(tops) == 1 and None not in tops:
+                previous = tops.pop()
+                if len(kept[previous].qubits) != len(qubits) or kept[previous].clbits:
+                    previous = None
+        if previous is not None:
+            before = kept[previous]
+            if _cancels(before, instruction):
+                alive[previous] = False
+                alive[i] = False
+                for q in qubits:
+                    stacks[q].pop()
+                continue
+            if before.name == instruction.name and instruction.name in _ROTATIONS and before.qubits == qubits \
+                    and all(isinstance(p, (int, float)) for p in before.params + instruction.params):
+                angle = math.fmod(before.params[0] + instruction.params[0], _ROTATIONS[instruction.name])
+                alive[i] = False
+                if math.isclose(angle, 0, abs_tol= 1e-12) or math.isclose(abs(angle), _ROTATIONS[instruction.name]):
+                    alive[previous] = False
+                    for q in qubits:
+                        stacks[q].pop()
+                else:
+                    kept[previous] = before._replace(params= (angle,))
+                continue
+        for q in qubits:
+            stacks.setdefault(q, []).append(i)
+    return [instruction for instruction, isAlive in zip(kept, alive) if isAlive]
+
+def drop_unmeasured(instructions):
+    """
+    Removes gates that can not affect any measurement
+    Walking backwards a gate is kept only if it touches a qubit that is
+    measured later or is linked to one by a later kept gate
+    Circuits without measurements are returned unchanged
+    """
+    if not any(instruction.name == "measure" for instruction in instructions):
+        return list(instructions)
+    live = set()
+    kept = []
+    for instruction in reversed(instructions):
+        if instruction.name == "reset":
+            #Nothing before a reset on a qubit reaches the measurements after it
+            if live.intersection(instruction.qubits):
+                live.difference_update(instruction.qubits)
+                kept.append(instruction)
+        elif instruction.name == "measure" or live.intersection(instruction.qubits):
+            live.update(instruction.qubits)
+            kept.append(instruction)
+    kept.reverse()
+    return kept
+
+def adjoint(instruction):
+    """
+    Returns the gate that undoes instruction
+    Raises a ValueError for measurements and other non unitary operations
+    """
+    name = instruction.name
+    if name in _SELF_INVERSE or name == "barrier":
+        return instruction
+    if name in _INVERSES:
+        return instruction._replace(name= _INVERSES[name])
+    if name in _NEGATED:
+        return instruction._replace(params= tuple(-instruction.params[i] for i in _NEGATED[name]))
+    raise ValueError("%s can not be inverted" % name)
+
+def inverse(instructions):
+    """
+    Returns the instructions that undo instructions
+    """
+    return [adjoint(instruction) for instruction in reversed(instructions)]
+
+def optimize(instructions):
+    """
+    Runs every pass over the instructions
+    Returns the optimized instructions and a report of the
+    gate counts and depth before and after
+    """
+    report = {"gates_before": len(instructions), "depth_before": depth(instructions)}
+    #Cancelling a pair can cut the last link from a qubit to a measurement so drop again after
+    optimized = drop_unmeasured(cancel_adjacent(drop_unmeasured(instructions)))
+    report["gates_after"] = len(optimized)
+    report["depth_after"] = depth(optimized)
+    return optimized, report
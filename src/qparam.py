@@ -0,0 +1,71 @@
+from __future__ import annotations
+from collections import namedtuple
+import math
+
+class qparam(object):
+    """
+    A named value that is left symbolic while a circuit is built
+    and supplied for each run by qclass.run_bindings
+    Can be used as a qint initial value or as a probability
+    for q_prob, cprob and qbool
+    """
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self):
+        return "qparam(%r)" % self.name
+
+    def bit(self, i: int):
+        """
+        The rotation angle that flips a qubit when bit i of the value is 1
+        """
+        return qexpr(self.name, "bit", i, 1)
+
+    def angle(self):
+        """
+        The rx angle that gives a |0> qubit the value as its probability of 1
+        """
+        return qexpr(self.name, "angle", None, 1)
+
+
+class qexpr(namedtuple("qexpr", ["name", "kind", "arg", "scale"])):
+    """
+    A gate parameter computed from the value bound to a qparam
+    """
+    def evaluate(self, values: dict):
+        """
+        Returns the angle for the bound values
+        """
+        value = values[self.name]
+        if self.kind == "bit":
+            return self.scale*math.pi*((value >> self.arg) & 1)
+        return self.scale*2*math.asin(math.sqrt(value))
+
+    def __neg__(self):
+        return self._replace(scale= -self.scale)
+
+    @property
+    def label(self):
+        """
+        A name for the expression that is a valid identifier
+        """
+        return "%s_%s%s%s" % (self.name, self.kind, "" if self.arg is None else self.arg, "_neg" if self.scale < 0 else "")
+
+def is_symbolic(params):
+    return any(isinstance(p, qexpr) for p in params)
+
+def bind(instructions, values: dict):
+    """
+    Returns the instructions with every qexpr replaced by its angle
+    Bit flips become an x gate or are dropped
+    """
+    toReturn = []
+    for instruction in instructions:
+        if not is_symbolic(instruction.params):
+            toReturn.append(instruction)
+        elif instruction.params[0].kind == "bit":
+            if instruction.params[0].evaluate(values):
+                toReturn.append(instruction._replace(name= "x", params= ())) #rx(pi) is x up to a global phase
+        else:
+            toReturn.append(instruction._replace(params= tuple(p.evaluate(values) if isinstance(p, qexpr) else p for p in instruction.params)))
+    return toReturn
@@ -0,0 +1,74 @@
+from __future__ import annotations
+import qoptimizer
+
+class qscope(object):
+    """
+    Context manager that uncomputes every gate recorded inside it on exit
+    Qubits allocated inside the scope come back to |0> and are returned
+    to the allocator, registers passed to keep are first copied onto
+    fresh qubits so their values survive
+    Registers allocated before the scope are uncomputed too, so gates
+    applied to them inside it are reverted and they can not be kept
+    with qclass.scope() as scope:
+        result = scope.keep(a.qand(b).qor(c))
+    """
+    def __init__(self, qclass):
+        self.qclass = qclass
+        self.kept = []
+        self._start = None
+        self._allocated = None
+
+    def _in_use(self):
+        allocator = self.qclass.qubitAllocator
+        return {i for i in range(allocator.size) if not allocator.is_free(i)}
+
+    def keep(self, register):
+        """
+        Marks a qint or qbool computed in the scope as a result
+        Returns the register, which points at its copy after the scope exits
+        Raises ValueError for a register allocated before the scope
+        """
+        qubits = [register.qubit] if hasattr(register, "qubit") else list(register.qubits)
+        if self._allocated.intersection(qubits):
+            raise ValueError("Only registers allocated inside the scope can be kept")
+        self.kept.append(register)
+        return register
+
+    def __enter__(self):
+        self._start = len(self.qclass.instructions)
+        self._allocated = self._in_use()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is not None:
+            return False
+        qclass = self.qclass
+        computed = qclass.instructions[self._start:]
+        uncompute = qoptimizer.inverse(computed) #Raises before anything is emitted if a gate can not be undone
+        temporary = self._in_use() - self._allocated
+        #Ancillas already returned inside the scope are used again while uncomputing
+        #so they are held back from the copies
+        allocator = qclass.qubitAllocator
+        touched = {q for instruction in computed for q in instruction.qubits}
+        held = allocator.claim(sorted(q for q in touched if allocator.is_free(q)))
+        with qclass.metrics.track("qscope.keep"):
+            copies = []
+            for register in self.kept:
+                qubits = [register.qubit] if hasattr(register, "qubit") else list(register.qubits)
+                fresh = qclass.chunk(len(qubits))
+                for source, target in zip(qubits, fresh):
+                    qclass.cx(source, target)
+                copies.append(fresh)
+        qclass.return_chunk(held)
+        with qclass.metrics.track("qscope.uncompute"):
+            for instruction in uncompute:
+                qclass.append(*instruction)
+        qclass.return_chunk(sorted(temporary))
+        for register, fresh in zip(self.kept, copies):
+            if hasattr(register, "qubit"):
+                register.qubit = fresh[0]
+            else:
+                if getattr(register, "firstQubit", None) is not None:
+                    register.firstQubit = fresh[register.qubits.index(register.firstQubit)]
+                register.qubits = fresh
+        return False
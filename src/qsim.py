@@ -0,0 +1,408 @@
+from __future__ import annotations
+import numpy as np
+import math
+import time
+import qstabilizer
+
+_SQRT_HALF = 1/math.sqrt(2)
+
+#Fixed single qubit gates as 2x2 matrices
+_GATES = {
+    "id": np.array([[1, 0], [0, 1]], dtype=complex),
+    "x": np.array([[0, 1], [1, 0]], dtype=complex),
+    "y": np.array([[0, -1j], [1j, 0]], dtype=complex),
+    "z": np.array([[1, 0], [0, -1]], dtype=complex),
+    "h": np.array([[_SQRT_HALF, _SQRT_HALF], [_SQRT_HALF, -_SQRT_HALF]], dtype=complex),
+    "s": np.array([[1, 0], [0, 1j]], dtype=complex),
+    "sdg": np.array([[1, 0], [0, -1j]], dtype=complex),
+    "t": np.array([[1, 0], [0, np.exp(1j*math.pi/4)]], dtype=complex),
+    "tdg": np.array([[1, 0], [0, np.exp(-1j*math.pi/4)]], dtype=complex),
+}
+
+#Controlled gates and the number of control qubits they take
+_CONTROLLED = {
+    "cx": ("x", 1),
+    "cy": ("y", 1),
+    "cz": ("z", 1),
+    "ch": ("h", 1),
+    "ccx": ("x", 2),
+    "crz": ("rz", 1),
+    "cu1": ("u1", 1),
+    "cu3": ("u3", 1),
+}
+
+#Gates that keep computational basis states as basis states, so circuits
+#made only of these (plus measure and reset) can be run with integer bit operations
+_FLIPS = {"x", "y"} #y is a flip up to a phase
+_CONTROLLED_FLIPS = {"cx": 1, "cy": 1, "ccx": 2}
+_DIAGONAL = {"id", "z", "s", "sdg", "t", "tdg", "u1", "rz", "cz", "cu1", "crz", "barrier"}
+_CLASSICAL = _FLIPS | set(_CONTROLLED_FLIPS) | _DIAGONAL | {"mct", "swap", "measure", "reset"}
+
+def is_classical(instructions):
+    """
+    Checks whether the instructions only ever map basis states to basis states
+    """
+    return all(instruction[0] in _CLASSICAL for instruction in instructions)
+
+def evaluate_classical(instructions):
+    """
+    Runs instructions that pass is_classical from |0...0> with one bit per qubit
+    of a python int and returns the classical register as an int
+    """
+    state = 0
+    record = 0
+    for name, qubits, clbits, params in instructions:
+        if name in _FLIPS:
+            state ^= 1 << qubits[0]
+        elif name in _CONTROLLED_FLIPS or name == "mct":
+            numControls = params[0] if name == "mct" else _CONTROLLED_FLIPS[name]
+            if all((state >> q) & 1 for q in qubits[:numControls]):
+                state ^= 1 << qubits[-1]
+        elif name == "swap":
+            a, b = qubits
+            if ((state >> a) ^ (state >> b)) & 1:
+                state ^= (1 << a) | (1 << b)
+        elif name == "measure":
+            record = (record & ~(1 << clbits[0])) | (((state >> qubits[0]) & 1) << clbits[0])
+        elif name == "reset":
+            state &= ~(1 << qubits[0])
+    return record
+
+def _matrix(name: str, params):
+    """
+    Returns the 2x2 matrix of a single qubit gate
+    """
+    if name in _GATES:
+        return _GATES[name]
+    if name == "rx":
+        theta = params[0]/2
+        return np.array([[math.cos(theta), -1j*math.sin(theta)], [-1j*math.sin(theta), math.cos(theta)]])
+    if name == "ry":
+        theta = params[0]/2
+        return np.array([[math.cos(theta), -math.sin(theta)], [math.sin(theta), math.cos(theta)]], dtype=complex)
+    if name == "rz":
+        return np.array([[np.exp(-0.5j*params[0]), 0], [0, np.exp(0.5j*params[0])]])
+    if name == "u1":
+        return np.array([[1, 0], [0, np.exp(1j*params[0])]])
+    if name == "u2":
+        phi, lam = params
+        return _SQRT_HALF*np.array([[1, -np.exp(1j*lam)], [np.exp(1j*phi), np.exp(1j*(phi + lam))]])
+    if name == "u3":
+        theta, phi, lam = params
+        return np.array([[math.cos(theta/2), -np.exp(1j*lam)*math.sin(theta/2)],
+                         [np.exp(1j*phi)*math.sin(theta/2), np.exp(1j*(phi + lam))*math.cos(theta/2)]])
+    raise ValueError("qsim does not support the %s gate" % name)
+
+def apply_gate(state, matrix, target: int, controls= ()):
+    """
+    Applies a 2x2 matrix to the target axis of a statevector
+    tensor on the slice where every control qubit is 1
+    """
+    index = [slice(None)] * state.ndim
+    for control in controls:
+        index[control] = 1
+    index[target] = 0
+    zero = tuple(index)
+    index[target] = 1
+    one = tuple(index)
+    a = state[zero].copy()
+    b = state[one]
+    state[zero] = matrix[0, 0]*a + matrix[0, 1]*b
+    state[one] = matrix[1, 0]*a + matrix[1, 1]*b
+
+def apply_instruction(state, name: str, qubits, params):
+    """
+    Applies a single unitary instruction to a statevector tensor
+    qubits must already be mapped onto the tensor's axes
+    """
+    if name == "barrier":
+        return
+    if name == "mct":
+        numControls = params[0]
+        apply_gate(state, _GATES["x"], qubits[-1], qubits[:numControls])
+    elif name == "swap":
+        state[...] = np.swapaxes(state, qubits[0], qubits[1]).copy()
+    elif name in _CONTROLLED:
+        gate, numControls = _CONTROLLED[name]
+        apply_gate(state, _matrix(gate, params), qubits[numControls], qubits[:numControls])
+    else:
+        apply_gate(state, _matrix(name, params), qubits[0])
+
+
+class _configuration(object):
+    """
+    The subset of a backend configuration used by qclass
+    """
+    def __init__(self, backend_name: str, n_qubits: int):
+        self.backend_name = backend_name
+        self.n_qubits = n_qubits
+        self.simulator = True
+        self.local = True
+        self.coupling_map = None
+
+
+class _result(object):
+    """
+    Holds the counts and memory of finished experiments
+    """
+    def __init__(self, counts: list, memory: list):
+        self._counts = counts
+        self._memory = memory
+
+    def get_counts(self, experiment= None):
+        """
+        Returns the counts dict of an experiment
+        The experiment may be omitted when only one was run
+        """
+        if experiment is None:
+            experiment = 0
+        return self._counts[experiment]
+
+    def get_memory(self, experiment= None):
+        """
+        Returns the per shot results of an experiment
+        Only available when the job was run with memory=True
+        """
+        if experiment is None:
+            experiment = 0
+        if self._memory[experiment] is None:
+            raise RuntimeError("Memory was not requested for this job")
+        return self._memory[experiment]
+
+
+class _job(object):
+    """
+    A local job whose result becomes available at readyAt
+    """
+    def __init__(self, result: _result, readyAt: float= 0):
+        self._result = result
+        self.readyAt = readyAt
+
+    def done(self):
+        return time.time() >= self.readyAt
+
+    def result(self):
+        """
+        Blocks until the job is ready and returns its result
+        """
+        wait = self.readyAt - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        return self._result
+
+
+class qsim(object):
+    """
+    Local NumPy statevector simulator
+    Exposes the parts of an IBMQ backend used by qclass so
+    circuits can be run offline without credentials
+    Circuits that only permute basis states skip the statevector
+    and run as integer bit operations at any width, and Clifford
+    circuits run on a stabilizer tableau, see engine
+    """
+    def __init__(self, n_qubits= 32, seed= None, max_qubits= 24, name= "qsim_statevector", latency= 0.0):
+        """
+        n_qubits is the width reported to qclass
+        max_qubits bounds the statevector which is only built over the qubits an experiment touches
+        latency is how many seconds each job waits before its result
+        is ready, to stand in for a remote queue
+        """
+        self._configuration = _configuration(name, n_qubits)
+        self.max_qubits = max_qubits
+        self.latency = latency
+        self.rng = np.random.default_rng(seed)
+
+    def configuration(self):
+        return self._configuration
+
+    def name(self):
+        return self._configuration.backend_name
+
+    def run(self, experiments, shots= 1024, memory= False, seed= None):
+        """
+        Simulates one experiment or a list of experiments
+        Each experiment is a tuple of (instructions, number of qubits, number of classical bits)
+        A seed makes the job reproducible, otherwise the backend's generator is used
+        Returns a completed job
+        """
+        rng = self.rng if seed is None else np.random.default_rng(seed)
+        if isinstance(experiments, tuple):
+            experiments = [experiments]
+        allCounts = []
+        allMemory = []
+        for instructions, numQubits, numClbits in experiments:
+            engine = self.engine(instructions)
+            if engine == "classical":
+                #Basis states stay basis states so every shot gives the same result at any width
+                counts = {format(evaluate_classical(instructions), '0%db' % numClbits): shots}
+            elif engine == "stabilizer":
+                counts = qstabilizer.simulate(instructions, numClbits, shots, rng)
+            else:
+                counts = self.simulate(instructions, numClbits, shots, rng)
+            allCounts.append(counts)
+            allMemory.append(self._memory(counts, rng) if memory else None)
+        return _job(_result(allCounts, allMemory), time.time() + self.latency)
+
+    @staticmethod
+    def engine(instructions):
+        """
+        Returns the engine run uses for instructions
+        classical for circuits that stay in basis states, stabilizer for
+        Clifford circuits and statevector for everything else
+        """
+        if is_classical(instructions):
+            return "classical"
+        if qstabilizer.is_clifford(instructions):
+            return "stabilizer"
+        return "statevector"
+
+    def _memory(self, counts: dict, rng):
+        """
+        Expands a counts dict to a shuffled list of per shot results
+        """
+        memory = [key for key, count in counts.items() for i in range(count)]
+        rng.shuffle(memory)
+        return memory
+
+    def _axes(self, instructions):
+        """
+        Maps each qubit an experiment touches onto a statevector axis
+        """
+        touched = set()
+        for name, qubits, clbits, params in instructions:
+            if name == "mct":
+                #mct is applied natively so its ancillas are never touched
+                touched.update(qubits[:params[0]])
+                touched.add(qubits[-1])
+            else:
+                touched.update(qubits)
+        touched = sorted(touched)
+        if len(touched) > self.max_qubits:
+            raise OverflowError("%d qubits is too many for a statevector simulation" % len(touched))
+        return {q: i for i, q in enumerate(touched)}
+
+    def statevector(self, instructions):
+        """
+        Returns the final statevector tensor of the unitary instructions
+        with one axis per touched qubit and the qubit to axis mapping
+        """
+        axes = self._axes(instructions)
+        state = np.zeros((2,) * len(axes), dtype=complex)
+        state[(0,) * len(axes)] = 1
+        for name, qubits, clbits, params in instructions:
+            if name in ("measure", "reset"):
+                raise ValueError("statevector can not be computed for a circuit with measurements or resets")
+            apply_instruction(state, name, [axes.get(q) for q in qubits], params)
+        return state, axes
+
+    def marginals(self, instructions, registers):
+        """
+        Returns the exact joint distribution of registers after the unitary instructions
+        Each register is a list of qubits with bit i of its value on registers[i]
+        None stands for a bit that is always 0
+        The result maps tuples of register values to their probabilities
+        """
+        state, axes = self.statevector(instructions)
+        kept = sorted(set(axes[q] for register in registers for q in register if q in axes))
+        others = tuple(axis for axis in range(state.ndim) if axis not in kept)
+        probs = np.sum(np.abs(state)**2, axis= others).reshape(-1)
+        outcomes = np.nonzero(probs > 1e-12)[0]
+        position = {axis: len(kept) - 1 - j for j, axis in enumerate(kept)} #Bit of the flat index holding each axis
+        columns = []
+        for register in registers:
+            values = np.zeros(len(outcomes), dtype= object if len(register) > 62 else np.int64)
+            for i, q in enumerate(register):
+                if q in axes:
+                    bits = (outcomes >> position[axes[q]]) & 1
+                    values = values | (bits.astype(values.dtype) << i)
+            columns.append(values.tolist())
+        toReturn = {}
+        for row, prob in zip(zip(*columns), probs[outcomes].tolist()):
+            toReturn[row] = toReturn.get(row, 0.0) + prob
+        return toReturn
+
+    def simulate(self, instructions, numClbits: int, shots: int, rng= None):
+        """
+        Samples shots results of the instructions and
+        returns the counts keyed by classical register bitstrings
+        Measurements followed by more gates on the same qubit collapse
+        the state, all others are sampled together at the end
+        Resets collapse the qubit and then return it to |0>
+        """
+        if rng is None:
+            rng = self.rng
+        axes = self._axes(instructions)
+        lastTouch = {}
+        for i, instruction in enumerate(instructions):
+            for q in instruction[1]:
+                lastTouch[q] = i
+        state = np.zeros((2,) * len(axes), dtype=complex)
+        state[(0,) * len(axes)] = 1
+        branches = [(state, shots, 0)] #(state, shots landing in this branch, classical bits so far)
+        deferred = {} #axis -> classical bit for measurements at the end of a qubit's life
+        for i, (name, qubits, clbits, params) in enumerate(instructions):
+            if name == "measure":
+                axis = axes[qubits[0]]
+                deferred = {a: c for a, c in deferred.items() if c != clbits[0]}
+                mask = ~(1 << clbits[0])
+                if lastTouch[qubits[0]] == i:
+                    deferred[axis] = clbits[0]
+                    branches = [(s, n, record & mask) for s, n, record in branches]
+                else:
+                    branches = self._collapse(branches, axis, clbits[0], rng)
+            elif name == "reset":
+                branches = self._collapse(branches, axes[qubits[0]], None, rng, reset= True)
+            else:
+                mapped = [axes.get(q) for q in qubits]
+                for branch in branches:
+                    apply_instruction(branch[0], name, mapped, params)
+        counts = {}
+        for branchState, branchShots, record in branches:
+            for outcome, count in self._sample(branchState, branchShots, record, deferred, rng).items():
+                key = format(outcome, '0%db' % numClbits)
+                counts[key] = counts.get(key, 0) + count
+        return counts
+
+    def _collapse(self, branches, axis: int, classBit: int, rng, reset= False):
+        """
+        Splits every branch on the outcome of measuring axis
+        recording it in classBit unless that is None
+        With reset the qubit is then flipped back to |0> in the branch that measured 1
+        """
+        newBranches = []
+        for state, shots, record in branches:
+            probs = np.abs(np.moveaxis(state, axis, 0).reshape(2, -1))**2
+            probOne = min(max(probs[1].sum()/probs.sum(), 0.0), 1.0)
+            ones = int(rng.binomial(shots, probOne))
+            for value, n in ((0, shots - ones), (1, ones)):
+                if n == 0:
+                    continue
+                index = [slice(None)] * state.ndim
+                index[axis] = 1 - value
+                collapsed = state.copy()
+                collapsed[tuple(index)] = 0
+                collapsed /= np.sqrt(np.sum(np.abs(collapsed)**2))
+                if reset and value:
+                    collapsed = np.flip(collapsed, axis).copy()
+                newRecord = record if classBit is None else (record & ~(1 << classBit)) | (value << classBit)
+                newBranches.append((collapsed, n, newRecord))
+        return newBranches
+
+    def _sample(self, state, shots: int, record: int, deferred: dict, rng):
+        """
+        Samples the deferred measurements of a branch
+        returning a dict of classical register values to counts
+        """
+        if not deferred:
+            return {record: shots}
+        kept = sorted(deferred)
+        others = tuple(axis for axis in range(state.ndim) if axis not in deferred)
+        probs = np.sum(np.abs(state)**2, axis=others).reshape(-1)
+        probs /= probs.sum()
+        sampled = rng.multinomial(shots, probs)
+        outcomes = np.nonzero(sampled)[0]
+        values = np.full(len(outcomes), record, dtype=object)
+        for j, axis in enumerate(kept):
+            bits = (outcomes >> (len(kept) - 1 - j)) & 1
+            values = values | (bits.astype(object) << deferred[axis])
+        return dict(zip(values.tolist(), sampled[outcomes].tolist()))
@@ -0,0 +1,217 @@
+from __future__ import annotations
+import math
+import numpy as np
+
+#Gates that map Pauli operators to Pauli operators
+_CLIFFORD = {"id", "x", "y", "z", "h", "s", "sdg", "cx", "cy", "cz", "swap", "barrier", "measure", "reset"}
+_ROTATIONS = {"rx", "ry", "rz", "u1"} #Clifford when the angle is a multiple of pi/2
+
+def _quarter_turns(angle):
+    """
+    Returns the angle as a number of quarter turns or None if it is not a whole number of them
+    """
+    if not isinstance(angle, (int, float)):
+        return None
+    turns = angle/(math.pi/2)
+    if abs(turns - round(turns)) > 1e-9:
+        return None
+    return int(round(turns)) % 4
+
+def is_clifford(instructions):
+    """
+    Checks whether the instructions can be simulated with a stabilizer tableau
+    """
+    for name, qubits, clbits, params in instructions:
+        if name in _ROTATIONS:
+            if _quarter_turns(params[0]) is None:
+                return False
+        elif name not in _CLIFFORD:
+            return False
+    return True
+
+def _phase(x1, z1, x2, z2):
+    """
+    Returns the power of i picked up per qubit when multiplying
+    the Pauli with bits x1, z1 into the Pauli with bits x2, z2
+    """
+    x1, z1, x2, z2 = (np.asarray(bits, dtype= np.int64) for bits in (x1, z1, x2, z2))
+    return np.where(x1 & z1, z2 - x2, np.where(x1, z2*(2*x2 - 1), np.where(z1, x2*(1 - 2*z2), 0)))
+
+
+class qstabilizer(object):
+    """
+    Stabilizer tableau of n qubits following Aaronson and Gottesman
+    Rows 0 to n-1 hold the destabilizers and rows n to 2n-1 the stabilizers,
+    each a Pauli string stored as x and z bits with its sign bit in r
+    Gates cost O(n) and measurements O(n^2) whatever the number of qubits
+    """
+    def __init__(self, n: int):
+        self.n = n
+        self.x = np.zeros((2*n, n), dtype= np.uint8)
+        self.z = np.zeros((2*n, n), dtype= np.uint8)
+        self.r = np.zeros(2*n, dtype= np.uint8)
+        diagonal = np.arange(n)
+        self.x[diagonal, diagonal] = 1
+        self.z[n + diagonal, diagonal] = 1
+
+    def copy(self):
+        toReturn = qstabilizer.__new__(qstabilizer)
+        toReturn.n = self.n
+        toReturn.x = self.x.copy()
+        toReturn.z = self.z.copy()
+        toReturn.r = self.r.copy()
+        return toReturn
+
+    def h(self, a: int):
+        x = self.x[:, a].copy()
+        self.r ^= x & self.z[:, a]
+        self.x[:, a] = self.z[:, a]
+        self.z[:, a] = x
+
+    def s(self, a: int):
+        self.r ^= self.x[:, a] & self.z[:, a]
+        self.z[:, a] ^= self.x[:, a]
+
+    def cx(self, a: int, b: int):
+        self.r ^= self.x[:, a] & self.z[:, b] & (self.x[:, b] ^ self.z[:, a] ^ 1)
+        self.x[:, b] ^= self.x[:, a]
+        self.z[:, a] ^= self.z[:, b]
+
+    def apply(self, name: str, qubits, params= ()):
+        """
+        Applies a gate that passes is_clifford
+        Global phases are dropped
+        """
+        if name == "x":
+            self.r ^= self.z[:, qubits[0]]
+        elif name == "y":
+            self.r ^= self.x[:, qubits[0]] ^ self.z[:, qubits[0]]
+        elif name == "z":
+            self.r ^= self.x[:, qubits[0]]
+        elif name == "h":
+            self.h(qubits[0])
+        elif name == "s":
+            self.s(qubits[0])
+        elif name == "sdg":
+            self.s(qubits[0])
+            self.apply("z", qubits)
+        elif name == "cx":
+            self.cx(*qubits)
+        elif name == "cy":
+            self.apply("sdg", qubits[1:])
+            self.cx(*qubits)
+            self.s(qubits[1])
+        elif name == "cz":
+            self.h(qubits[1])
+            self.cx(*qubits)
+            self.h(qubits[1])
+        elif name == "swap":
+            a, b = qubits
+            self.cx(a, b)
+            self.cx(b, a)
+            self.cx(a, b)
+        elif name in ("rz", "u1"):
+            for i in range(_quarter_turns(params[0])):
+                self.s(qubits[0])
+        elif name == "rx":
+            self.h(qubits[0])
+            self.apply("rz", qubits, params)
+            self.h(qubits[0])
+        elif name == "ry":
+            #ry is rx conjugated by s
+            self.apply("sdg", qubits)
+            self.apply("rx", qubits, params)
+            self.s(qubits[0])
+
+    def _rowsum(self, rows, i: int):
+        """
+        Multiplies row i into each of rows
+        """
+        total = 2*self.r[rows].astype(np.int64) + 2*int(self.r[i]) \
+                + _phase(self.x[i], self.z[i], self.x[rows], self.z[rows]).sum(axis= -1)
+        self.r[rows] = (total % 4) // 2
+        self.x[rows] ^= self.x[i]
+        self.z[rows] ^= self.z[i]
+
+    def _pivot(self, a: int):
+        """
+        Returns a stabilizer row that anticommutes with Z on qubit a or None if there is none
+        """
+        rows = np.nonzero(self.x[self.n:, a])[0]
+        return self.n + int(rows[0]) if len(rows) else None
+
+    def outcomes(self, a: int):
+        """
+        Returns the results measuring qubit a can give
+        (0, 1) with equal probability or a single determined result
+        """
+        if self._pivot(a) is not None:
+            return (0, 1)
+        x = np.zeros(self.n, dtype= np.uint8)
+        z = np.zeros(self.n, dtype= np.uint8)
+        r = 0
+        for i in np.nonzero(self.x[:self.n, a])[0]:
+            row = self.n + i
+            r = ((2*r + 2*int(self.r[row]) + int(_phase(self.x[row], self.z[row], x, z).sum())) % 4) // 2
+            x ^= self.x[row]
+            z ^= self.z[row]
+        return (r,)
+
+    def collapse(self, a: int, value: int):
+        """
+        Updates the tableau for qubit a having been measured as value
+        which must be one of its outcomes
+        """
+        p = self._pivot(a)
+        if p is None:
+            return
+        rows = np.nonzero(self.x[:, a])[0]
+        rows = rows[rows != p]
+        if len(rows):
+            self._rowsum(rows, p)
+        self.x[p - self.n] = self.x[p]
+        self.z[p - self.n] = self.z[p]
+        self.r[p - self.n] = self.r[p]
+        self.x[p] = 0
+        self.z[p] = 0
+        self.z[p, a] = 1
+        self.r[p] = value
+
+def simulate(instructions, numClbits: int, shots: int, rng):
+    """
+    Samples shots results of instructions that pass is_clifford and
+    returns the counts keyed by classical register bitstrings
+    Shots are split between the two outcomes of each random measurement
+    so a tableau is only copied where the results differ
+    """
+    axes = {q: i for i, q in enumerate(sorted({q for instruction in instructions for q in instruction[1]}))}
+    branches = [(qstabilizer(len(axes)), shots, 0)] #(tableau, shots landing in this branch, classical bits so far)
+    for name, qubits, clbits, params in instructions:
+        mapped = [axes[q] for q in qubits]
+        if name not in ("measure", "reset"):
+            for tableau, n, record in branches:
+                tableau.apply(name, mapped, params)
+            continue
+        newBranches = []
+        for tableau, n, record in branches:
+            outcomes = tableau.outcomes(mapped[0])
+            if len(outcomes) == 1:
+                splits = [(outcomes[0], n)]
+            else:
+                ones = int(rng.binomial(n, 0.5))
+                splits = [(value, count) for value, count in ((0, n - ones), (1, ones)) if count]
+            for j, (value, count) in enumerate(splits):
+                branch = tableau if j == len(splits) - 1 else tableau.copy()
+                branch.collapse(mapped[0], value)
+                if name == "reset":
+                    if value:
+                        branch.apply("x", mapped)
+                    newBranches.append((branch, count, record))
+                else:
+                    newBranches.append((branch, count, (record & ~(1 << clbits[0])) | (value << clbits[0])))
+        branches = newBranches
+    counts = {}
+    for tableau, n, record in branches:
+        key = format(record, '0%db' % numClbits)
+        counts[key] = counts.get(key, 0) + n
+    return counts
@@ -0,0 +1,72 @@
+from __future__ import annotations
+from collections import deque
+import numpy as np
+
+class qtopology(object):
+    """
+    Distances between the physical qubits of a device
+    built from its coupling map, used to place chunks on
+    connected qubits and to estimate the swaps a gate needs
+    """
+    def __init__(self, couplingMap, size: int= None):
+        if size is None:
+            size = max(max(edge) for edge in couplingMap) + 1
+        self.size = size
+        neighbours = [set() for i in range(size)]
+        for a, b in couplingMap:
+            neighbours[a].add(b)
+            neighbours[b].add(a)
+        self.neighbours = neighbours
+        self.distance = np.full((size, size), 2*size, dtype= np.int64) #Unreachable pairs count as very far
+        for start in range(size):
+            self.distance[start, start] = 0
+            queue = deque([start])
+            while queue:
+                q = queue.popleft()
+                for n in neighbours[q]:
+                    if self.distance[start, n] > self.distance[start, q] + 1:
+                        self.distance[start, n] = self.distance[start, q] + 1
+                        queue.append(n)
+
+    def place(self, free, n: int, near= ()):
+        """
+        Returns n of the free qubits that are as close to each other
+        and to the qubits in near as possible
+        Each candidate grows from a seed by repeatedly adding the free qubit
+        with the smallest total distance to those already chosen
+        """
+        free = np.array(sorted(free), dtype= np.int64)
+        near = list(near)
+        if near:
+            #Grow from the free qubit closest to near
+            seeds = [free[np.argmin(self.distance[np.ix_(free, near)].sum(axis= 1))]]
+        else:
+            seeds = free
+        best = None
+        for seed in seeds:
+            chosen = [int(seed)]
+            available = free != seed
+            score = self.distance[free, seed].copy()
+            if near:
+                score += self.distance[np.ix_(free, near)].sum(axis= 1)
+            total = 0
+            while len(chosen) < n:
+                masked = np.where(available, score, np.iinfo(np.int64).max)
+                pick = int(np.argmin(masked)) #Ties go to the lowest index
+                total += int(self.distance[free[pick], chosen].sum())
+                chosen.append(int(free[pick]))
+                available[pick] = False
+                score += self.distance[free, free[pick]]
+            if best is None or total < best[0]:
+                best = (total, chosen)
+        return sorted(best[1])
+
+    def swaps(self, qubits, numControls: int= None):
+        """
+        Estimates the swaps needed to bring every control
+        next to the target of a gate on qubits
+        """
+        if numControls is None:
+            numControls = len(qubits) - 1
+        target = qubits[-1]
+        return int(sum(max(self.distance[control, target] - 1, 0) for control in qubits[:numControls]))
@@ -5,11 +5,26 @@ Test cases for the core modules
 import unittest
 import qiskit
 import os
+import sys
+import subprocess
+import time
+import asyncio
+import threading
+import json
 from random import choice
 from itertools import combinations
 from qclass import qclass
 from qint import qint
 from qbool import qbool
+from qsim import qsim, is_classical
+from qentropy import qentropy
+from qallocator import qallocator
+from qcache import qcache, resultcache, transpilecache
+import tempfile
+from qclass import qop
+import qoptimizer
+from qparam import qparam
+from qtopology import qtopology
 
 
 
@@ -51,16 +66,26 @@ class BaseTestQclass(unittest.TestCase):
         
     def tearDown(self):
         super().tearDown()
-        try:
+        if os.path.exists(self.qclass.qasmDir):
             os.remove(self.qclass.qasmDir)
-        except:
-            print("Couldn't remove compiled OpenQASM at %s location" % self.qclass.qasmDir)
 
-    def test_creates_file(self):
+    def test_no_file_until_saved(self):
         """
-        Tests whether a file is properly created
+        Tests that no file is written unless
+        the OpenQASM is explicitly saved
         """
+        self.qclass.run()
+        self.assertFalse(os.path.exists(self.qclass.qasmDir))
+        self.qclass.save_qasm()
         self.assertTrue(os.path.exists(self.qclass.qasmDir))
+
+    def test_records_instructions(self):
+        """
+        Tests whether gates are recorded in memory
+        """
+        self.qclass.cx(0, 1)
+        self.qclass.measure(1, 0)
+        self.assertEqual(self.qclass.instructions, [("cx", (0, 1), (), ()), ("measure", (1,), (0,), ())])
     
     def test_size_backend(self):
         """
@@ -97,6 +122,21 @@ class BaseTestQclass(unittest.TestCase):
         chunk1 = self.qclass.chunk(20)
         self.assertRaises(OverflowError, self.qclass.chunk, 20)
 
+    def test_transpile_cache(self):
+        """
+        Tests whether rebuilding the same circuit
+        reuses its transpilation
+        """
+        self.addCleanup(setattr, qclass, "transpileCache", qclass.transpileCache)
+        qclass.transpileCache = transpilecache()
+        for i in range(2):
+            program = qclass(backend= self.qclass.backend)
+            program.localFastPath = False #The circuit is classical and must reach the transpiler
+            program.start()
+            qint(program, value= 5, size= 3).measure()
+            program.run()
+        self.assertEqual((qclass.transpileCache.hits, qclass.transpileCache.misses), (1, 1))
+
     def test_request_chunk(self):
         """
         tests whether request chunk works as intended
@@ -119,9 +159,7 @@ class InitTestQclass(unittest.TestCase):
         super().tearDown()
         try:
             self.qclass.run()
-            os.remove(self.qclass.qasmDir)
         except:
-            os.remove(self.qclass.qasmDir)
             raise AssertionError("qClass no longer runs for this case")
 
     def test_str_backend(self):
@@ -164,10 +202,8 @@ class TestBasicQint(unittest.TestCase):
     
     def tearDown(self):
         super().tearDown()
-        try:
+        if os.path.exists(self.qclass.qasmDir):
             os.remove(self.qclass.qasmDir)
-        except:
-            print("Couldn't remove compiled OpenQASM at %s location" % self.qclass.qasmDir)
 
     def test_nothing(self):
         """
@@ -325,10 +361,8 @@ class TestBasicQbool(unittest.TestCase):
     
     def tearDown(self):
         super().tearDown()
-        try:
+        if os.path.exists(self.qclass.qasmDir):
             os.remove(self.qclass.qasmDir)
-        except:
-            print("Couldn't remove compiled OpenQASM at %s location" % self.qclass.qasmDir)
 
     def test_base_is_false(self):
         """
@@ -638,4 +672,728 @@ class TestBasicQbool(unittest.TestCase):
                 toTest.append((v, otherVal))
             except KeyError:
                 toTest.append((v, 0))
-        self.assertTrue(kinda_close_tuples(toTest))
\ No newline at end of file
+        self.assertTrue(kinda_close_tuples(toTest))
+
+
+class TestQsim(unittest.TestCase):
+    """
+    Tests the local statevector simulator
+    which runs without an IBMQ account
+    """
+    def setUp(self):
+        super().setUp()
+        self.qclass = qclass(backend= qsim(seed= 7))
+        self.qclass.start()
+
+    def test_size_backend(self):
+        """
+        Tests whether the local backend reports its size
+        """
+        self.assertEqual(self.qclass.size, 32)
+
+    def test_increment(self):
+        """
+        Tests whether a pure qint increments locally
+        """
+        a = qint(self.qclass, value= 9, size= 5)
+        a.increment()
+        a.increment()
+        a.measure()
+        result = self.qclass.get_result()
+        self.assertEqual(a.extract_result(result), 11)
+
+    def test_prob(self):
+        """
+        Tests whether a qbool with a probability
+        is sampled close to that probability
+        """
+        base = qbool(self.qclass, prob=0.75)
+        base.measure()
+        counts = self.qclass.get_counts()
+        ones = sum(v for k, v in counts.items() if k[-1 - base.classBit] == '1')
+        self.assertTrue(kinda_close_tuples([(ones/1024, 0.75)], error= 0.1))
+
+    def test_entangled_counts(self):
+        """
+        Tests whether entangled qubits always
+        measure the same
+        """
+        self.qclass.ugate("h", 0)
+        self.qclass.cx(0, 1)
+        self.qclass.measure(0, 0)
+        self.qclass.measure(1, 1)
+        counts = self.qclass.get_counts()
+        self.assertTrue(all(k[-1] == k[-2] for k in counts.keys()))
+        self.assertEqual(sum(counts.values()), 1024)
+
+    def test_compact_registers(self):
+        """
+        Tests whether only the used qubits and
+        classical bits are emitted
+        """
+        a = qint(self.qclass, value= 9, size= 5)
+        a.measure()
+        instructions, quantSize, classSize = self.qclass.compact()
+        self.assertEqual((quantSize, classSize), (5, 5))
+        self.assertTrue(all(len(k) == 5 for k in self.qclass.get_counts().keys()))
+
+    def test_run_batch(self):
+        """
+        Tests whether a batch routes each circuit's
+        counts back to its own qclass
+        """
+        programs = []
+        ints = []
+        for value in range(4):
+            program = qclass(backend= self.qclass.backend)
+            program.start()
+            thisInt = qint(program, value= value, size= 3)
+            thisInt.measure()
+            programs.append(program)
+            ints.append(thisInt)
+        qclass.run_batch(programs)
+        for value in range(4):
+            self.assertEqual(ints[value].extract_result(programs[value].get_result()), value)
+
+    def test_rand_pool(self):
+        """
+        Tests whether quantrand serves many numbers
+        within range from a single pooled job
+        """
+        pool = qentropy(backend= self.qclass.backend, shots= 1024)
+        iterations = 100
+        for i in range(iterations):
+            self.assertIn(qint.quantrand(0, 1000, step= 10, pool= pool), range(0, 1000, 10))
+        self.assertEqual(pool.jobs, 1)
+
+    def test_rand_pool_refills(self):
+        """
+        Tests whether a failed background refill is retried
+        and whether threads that find the pool empty share one job
+        """
+        pool = qentropy(backend= qsim(seed= 7), width= 4, shots= 64)
+        sample = pool._sample
+        calls = []
+        def flaky():
+            calls.append(None)
+            if len(calls) in (1, 3): #The first job and the background refill fail
+                raise RuntimeError("transient")
+            return sample()
+        pool._sample = flaky
+        self.assertRaises(RuntimeError, pool.getbits, 4)
+        for i in range(100):
+            self.assertIn(pool.getbits(4), range(16))
+            if pool._refiller is not None:
+                pool._refiller.join()
+        self.assertEqual((len(calls), pool.jobs), (4, 2))
+        pool = qentropy(backend= qsim(seed= 7), width= 4, shots= 64)
+        slow = pool._sample
+        def delayed():
+            time.sleep(0.1)
+            return slow()
+        pool._sample = delayed
+        threads = [threading.Thread(target= pool.getbits, args= (8,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(pool.jobs, 1)
+
+    def test_mct_cache(self):
+        """
+        Tests whether repeated mct shapes reuse
+        the cached decomposition
+        """
+        a = qint(self.qclass, value= 9, size= 6)
+        ancillary = self.qclass.request_chunk(3)
+        for i in range(2):
+            self.qclass.mct(a.qubits[:5], a.qubits[5], ancillary= ancillary)
+            self.qclass.mct(a.qubits[:4], a.qubits[4], ancillary= ancillary)
+            self.qclass.mct(a.qubits[:3], a.qubits[3])
+        before = qclass.mct_cache_info()
+        self.qclass.to_circuit()
+        after = qclass.mct_cache_info()
+        self.assertGreater(after.hits, before.hits)
+        self.assertLessEqual(after.misses - before.misses, 3)
+        decomposed = qclass.decompose_mct([4, 2, 7], 2)
+        self.assertTrue(all(set(gate.qubits) <= {4, 2, 7} for gate in decomposed))
+
+    def test_joint_counts(self):
+        """
+        Tests whether the joint distribution of two
+        registers keeps their correlation
+        """
+        a = qbool(self.qclass, prob=0.5)
+        b = a._entangle_fresh(qbool(self.qclass))
+        c = qint(self.qclass, value= 6, size= 3)
+        a.measure()
+        c.measure()
+        b.measure()
+        counts = self.qclass.get_counts()
+        joint = self.qclass.extract_counts(counts, a, b, c)
+        self.assertEqual(set(joint.keys()), {(False, False, 6), (True, True, 6)})
+        self.assertEqual(sum(joint.values()), 1024)
+        self.assertEqual(c.extract_counts(counts), {6: 1024})
+
+    def test_async_in_flight(self):
+        """
+        Tests whether many slow jobs wait on
+        the queue at the same time
+        """
+        backend = qsim(seed= 7, latency= 0.2)
+        programs = []
+        for value in range(8):
+            program = qclass(backend= backend)
+            program.start()
+            thisInt = qint(program, value= value, size= 3)
+            thisInt.measure()
+            programs.append((program, thisInt))
+        async def gather():
+            return await asyncio.gather(*[program.get_counts_async() for program, thisInt in programs])
+        begin = time.time()
+        allCounts = asyncio.run(gather())
+        self.assertLess(time.time() - begin, 0.2 * 4)
+        for value, counts in enumerate(allCounts):
+            self.assertEqual(programs[value][1].extract_counts(counts), {value: 1024})
+
+    def test_future(self):
+        """
+        Tests whether run_future resolves to the result
+        """
+        a = qint(self.qclass, value= 5, size= 3)
+        a.measure()
+        result = self.qclass.run_future().result()
+        self.assertEqual(a.extract_counts(result.get_counts()), {5: 1024})
+
+    def test_result_cache(self):
+        """
+        Tests whether an identical circuit is served
+        from the cache in memory and then from disk
+        """
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        directory = temporary.name
+        cache = resultcache(directory= directory)
+        counts = []
+        for i in range(2):
+            program = qclass(backend= self.qclass.backend, cache= cache)
+            program.start()
+            thisInt = qint(program, value= 2, size= 3)
+            thisInt.all_vals()
+            thisInt.measure()
+            counts.append(program.get_counts())
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        fresh = resultcache(directory= directory)
+        self.assertEqual(fresh.get(program.cache_key()), counts[0])
+        self.assertEqual(fresh.diskHits, 1)
+
+    def test_transpile_cache_disk(self):
+        """
+        Tests whether the transpile cache keeps
+        circuits on disk between instances
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            circuit = [qop("x", (0,), (), ()), qop("measure", (0,), (0,), ())]
+            key = qcache.digest(circuit, "ibmqx4")
+            transpilecache(directory= directory).put(key, circuit)
+            fresh = transpilecache(directory= directory)
+            self.assertEqual(fresh.get(key), circuit)
+            self.assertEqual(fresh.stats()["disk_hits"], 1)
+            with open(fresh._path(key), 'wb') as corrupt:
+                corrupt.write(b"not a pickle")
+            self.assertIsNone(transpilecache(directory= directory).get(key))
+            base = qcache(directory= directory)
+            base.put("plain", {"a": 1})
+            self.assertEqual(qcache(directory= directory).get("plain"), {"a": 1})
+
+    def test_sp_values(self):
+        """
+        Tests whether a superposition only
+        holds the given values
+        """
+        nums = [1, 2, 3, 5, 9, 17, 100, 1000]
+        s = qint.super_position(nums, self.qclass)
+        s.measure_sup()
+        counts = s.extract_counts(self.qclass.get_counts())
+        self.assertEqual(set(counts.keys()), set(nums))
+
+    def test_sp_shared_bits(self):
+        """
+        Tests whether bits shared by every value
+        are set without any entangling gates
+        """
+        qint.super_position([24, 25, 26, 27, 28, 29, 30, 31], self.qclass, size= 5)
+        self.assertEqual(set(x.name for x in self.qclass.instructions), {"x", "rx"})
+
+    def test_sp_too_small(self):
+        """
+        Tests whether values too large for the given size are refused
+        """
+        self.assertRaises(OverflowError, qint.super_position, [1, 9, 12], self.qclass, size= 3)
+
+    def test_add_sub(self):
+        """
+        Tests whether add and sub change only the
+        target qint and wrap around modulo its size
+        """
+        a = qint(self.qclass, value= 11, size= 4)
+        b = qint(self.qclass, value= 7, size= 4)
+        c = qint(self.qclass, value= 3, size= 2)
+        a.add(b)
+        b.sub(c)
+        a.measure()
+        b.measure()
+        counts = self.qclass.get_counts()
+        self.assertEqual(a.extract_counts(counts), {(11 + 7) % 16: 1024})
+        self.assertEqual(b.extract_counts(counts), {4: 1024})
+
+    def test_add_const(self):
+        """
+        Tests whether constants are added and
+        subtracted without leaving ancillas in use
+        """
+        a = qint(self.qclass, value= 5, size= 5)
+        before = self.qclass.bitsLeft
+        a.add_const(30)
+        a.sub_const(2)
+        self.assertEqual(self.qclass.bitsLeft, before)
+        a.measure()
+        self.assertEqual(a.extract_counts(self.qclass.get_counts()), {(5 + 30 - 2) % 32: 1024})
+
+    def test_increment_adder(self):
+        """
+        Tests whether adding 1 through the adder carries across
+        every bit with only carry ancillas
+        """
+        a = qint(self.qclass, value= 63, size= 7)
+        a.add_const(1)
+        self.assertEqual(self.qclass.qubitAllocator.peak, 7 + 5)
+        a.measure()
+        self.assertEqual(a.extract_counts(self.qclass.get_counts()), {64: 1024})
+        self.assertNotIn("mct", [x.name for x in self.qclass.instructions])
+
+    def test_increment_superposed(self):
+        """
+        Tests whether a wide superposed qint increments
+        within the statevector limit
+        """
+        a = qint.super_position([7, 8], self.qclass, size= 14)
+        a.increment()
+        a.measure()
+        self.assertEqual(set(a.extract_counts(self.qclass.get_counts())), {8, 9})
+
+    def test_too_many_qubits(self):
+        """
+        Tests whether touching more qubits than the
+        statevector limit raises an OverflowError
+        The t gate keeps the circuit off the stabilizer engine
+        """
+        for i in range(25):
+            self.qclass.ugate("h", i)
+        self.qclass.ugate("t", 0)
+        self.assertRaises(OverflowError, self.qclass.run)
+
+    def test_metrics(self):
+        """
+        Tests whether gates are counted and attributed
+        to the outermost qint or qbool method
+        """
+        a = qbool(self.qclass, initial= True)
+        b = qbool(self.qclass)
+        a.qnand(b)
+        self.qclass.cx(a.qubit, b.qubit)
+        metrics = self.qclass.metrics_dict()
+        self.assertEqual(metrics["gates"], {"x": 2, "ccx": 1, "cx": 1})
+        self.assertEqual(metrics["two_qubit_gates"], 1)
+        self.assertEqual(metrics["depth"], 3)
+        self.assertEqual(metrics["operations"]["qbool.qnand"], {"ccx": 1, "x": 1})
+        self.assertEqual(metrics["operations"]["qclass"], {"cx": 1})
+        self.assertEqual(metrics["calls"]["qbool.qnand"], 1)
+        self.assertNotIn("qbool.qand", metrics["calls"])
+        self.assertEqual(metrics["qubits_in_use"], 3)
+
+    def test_metrics_hook(self):
+        """
+        Tests whether hooks see every instruction with its
+        operation and whether metrics export as JSON
+        """
+        seen = []
+        self.qclass.add_hook(lambda instruction, operation: seen.append((instruction.name, operation)))
+        a = qint(self.qclass, value= 1, size= 3)
+        a.increment()
+        self.assertEqual(seen, [("x", "qint.__init__"), ("ccx", "qint.increment"), ("cx", "qint.increment"), ("x", "qint.increment")])
+        self.assertEqual(json.loads(self.qclass.metrics_json())["peak_qubits"], 3)
+
+    def test_scope(self):
+        """
+        Tests whether a scope keeps its result and returns
+        every temporary qubit in a clean state
+        """
+        a = qbool(self.qclass, initial= True)
+        b = qbool(self.qclass, prob= 0.5)
+        c = qbool(self.qclass, initial= False)
+        for i in range(10):
+            #Without the scope these passes would need more qubits than the backend has
+            with self.qclass.scope() as scope:
+                result = scope.keep(a.qand(b).qor(c.qnand(a)))
+        self.assertEqual(self.qclass.bitsLeft, self.qclass.size - 13)
+        b.measure()
+        result.measure()
+        counts = self.qclass.extract_counts(self.qclass.get_counts(), b, result)
+        self.assertEqual(set(counts), {(False, True), (True, True)})
+
+    def test_scope_uncomputes(self):
+        """
+        Tests whether the qubits freed by a scope are back in |0>
+        and whether measuring inside a scope is refused
+        """
+        a = qint(self.qclass, value= 5, size= 3)
+        with self.qclass.scope() as scope:
+            b = qint(self.qclass, value= 2, size= 3)
+            b.add(a)
+            total = scope.keep(b)
+        freed = qint(self.qclass, size= 3)
+        self.assertEqual(set(freed.qubits), {3, 4, 5})
+        freed.measure()
+        total.measure()
+        result = self.qclass.get_result()
+        self.assertEqual((freed.extract_result(result), total.extract_result(result)), (0, 7))
+        with self.assertRaises(ValueError):
+            with self.qclass.scope():
+                qbool(self.qclass, initial= True).measure()
+        with self.assertRaises(ValueError):
+            with self.qclass.scope() as scope:
+                scope.keep(a)
+
+    def test_measure_reset(self):
+        """
+        Tests whether measured qints can hand their
+        qubits back for reuse within a small budget
+        """
+        self.qclass.start(quantSize= 4)
+        ints = []
+        for value in range(5):
+            thisInt = qint(self.qclass, value= value, size= 3)
+            thisInt.increment()
+            thisInt.measure(reset= True)
+            ints.append(thisInt)
+        self.assertEqual(self.qclass.bitsLeft, 4)
+        result = self.qclass.get_result()
+        self.assertEqual([thisInt.extract_result(result) for thisInt in ints], [1, 2, 3, 4, 5])
+
+    def test_qbool_reset(self):
+        """
+        Tests whether a reused qubit starts in |0> after
+        the qbool measured on it is reset
+        """
+        a = qbool(self.qclass, prob= 0.5)
+        a.measure(reset= True)
+        b = qbool(self.qclass)
+        self.assertEqual(self.qclass.instructions[-1].name, "reset")
+        b.measure()
+        self.assertEqual(self.qclass.extract_counts(self.qclass.get_counts(), b), {False: 1024})
+        self.assertRaises(ValueError, self.qclass.qubitAllocator.free, [b.qubit])
+
+    def test_probabilities(self):
+        """
+        Tests whether exact probabilities match a
+        superposition and a qbool's probability
+        """
+        nums = [1, 6, 9, 14, 22]
+        a = qint.super_position(nums, self.qclass, size= 5)
+        b = qbool(self.qclass, prob= 0.3)
+        probs = a.probabilities()
+        self.assertEqual(set(probs), set(nums))
+        for prob in probs.values():
+            self.assertAlmostEqual(prob, 0.2)
+        self.assertAlmostEqual(b.probability(), 0.3)
+        joint = self.qclass.get_probabilities(a, b)
+        self.assertAlmostEqual(joint[(6, True)], 0.06)
+
+    def test_probabilities_measured(self):
+        """
+        Tests whether measured bits are keyed like counts and
+        whether a gate after a measurement is refused
+        """
+        a = qbool(self.qclass, prob= 0.25)
+        b = a.entangle()
+        a.measure()
+        b.measure()
+        probs = self.qclass.get_probabilities()
+        self.assertEqual(set(probs), {"00", "11"})
+        self.assertAlmostEqual(probs["11"], 0.25)
+        a.qnot()
+        self.assertRaises(ValueError, self.qclass.get_probabilities)
+        raw = qclass(backend= qsim(seed= 7))
+        raw.start()
+        raw.ugate("x", 0)
+        raw.ugate("h", 1)
+        raw.measure(0, 0)
+        raw.measure(1, 1)
+        self.assertEqual(set(raw.get_probabilities()), set(raw.get_counts()))
+
+    def test_template(self):
+        """
+        Tests whether one template runs with several
+        bindings of its initial value and probability
+        """
+        a = qint(self.qclass, value= qparam("v"), size= 5)
+        a.increment()
+        b = qbool(self.qclass, prob= qparam("p"))
+        a.measure()
+        b.measure()
+        built = len(self.qclass.instructions)
+        allCounts = self.qclass.run_bindings([{"v": 3, "p": 0.0}, {"v": 30, "p": 1.0}, {"v": 31, "p": 0.5}])
+        self.assertEqual(len(self.qclass.instructions), built)
+        self.assertEqual(a.extract_counts(allCounts[0]), {4: 1024})
+        self.assertEqual(b.extract_counts(allCounts[1]), {True: 1024})
+        self.assertEqual(a.extract_counts(allCounts[2]), {0: 1024})
+        self.assertEqual(set(b.extract_counts(allCounts[2])), {True, False})
+        self.assertRaises(ValueError, self.qclass.run)
+        self.assertRaises(ValueError, self.qclass.get_probabilities)
+        self.assertAlmostEqual(b.probability(values= {"v": 3, "p": 0.25}), 0.25)
+
+    def test_adaptive_result(self):
+        """
+        Tests whether adaptive shots stop early for a dominant
+        result and use the whole cap for an even split
+        """
+        a = qint(self.qclass, value= 9, size= 5)
+        a.measure()
+        result, confidence, shots = self.qclass.get_result_adaptive(batch= 64)
+        self.assertEqual((a.extract_result(result), shots), (9, 64))
+        self.assertGreater(confidence, 0.99)
+        b = qbool(self.qclass, prob= 0.8)
+        b.measure()
+        result, confidence, shots = self.qclass.get_result_adaptive(batch= 64)
+        self.assertTrue(b.extract_result(result))
+        self.assertLess(shots, 8192)
+        even = qclass(backend= qsim(seed= 7), seed= 3)
+        even.start()
+        c = qbool(even, prob= 0.5)
+        c.measure()
+        result, confidence, shots = even.get_result_adaptive(maxShots= 1024)
+        self.assertEqual(shots, 1024)
+        self.assertLess(confidence, 0.99)
+
+    def test_adaptive_false_stops(self):
+        """
+        Tests whether an even split rarely stops early
+        despite being checked after every batch
+        """
+        even = qclass(backend= qsim())
+        even.start()
+        qbool(even, prob= 0.5).measure()
+        early = 0
+        for seed in range(300):
+            even.seed = seed*10000 #Batches are seeded from seed upwards so keep runs apart
+            result, confidence, shots = even.get_result_adaptive(batch= 64, maxShots= 1024)
+            early += shots < 1024
+        self.assertLessEqual(early, 6) #Twice the 1% allowed at the default confidence
+
+    def test_coupling_map(self):
+        """
+        Tests whether placing chunks on the coupling map
+        saves swaps and keeps results correct
+        """
+        melbourne = [[1, 0], [1, 2], [2, 3], [4, 3], [4, 10], [5, 4], [5, 6], [5, 9], [6, 8], [7, 8],
+                     [9, 8], [9, 10], [11, 3], [11, 10], [11, 12], [12, 2], [13, 1], [13, 12]]
+        thisQclass = qclass(backend= qsim(n_qubits= 14, seed= 7), couplingMap= melbourne)
+        thisQclass.start()
+        a = qint(thisQclass, value= 3, size= 4)
+        b = qint(thisQclass, value= 5, size= 4)
+        b.add(a)
+        a.increment()
+        report = thisQclass.swap_report()
+        self.assertGreater(report["swaps_saved"], 0)
+        self.assertEqual(report["naive_swaps"] - report["swaps"], report["swaps_saved"])
+        a.measure()
+        b.measure()
+        result = thisQclass.get_result()
+        self.assertEqual((a.extract_result(result), b.extract_result(result)), (4, 8))
+        self.assertRaises(ValueError, qclass(backend= qsim(), couplingMap= True).start)
+
+    def test_classical_fast_path(self):
+        """
+        Tests whether a circuit that stays in basis states runs
+        past the statevector limit and gives one deterministic result
+        """
+        thisQclass = qclass(backend= qsim(n_qubits= 128, seed= 7))
+        thisQclass.start()
+        a = qint(thisQclass, value= 2**31 - 1, size= 32)
+        b = qint(thisQclass, value= 5, size= 32)
+        a.increment()
+        b.add(a)
+        a.measure()
+        b.measure()
+        self.assertGreater(thisQclass.qubitAllocator.peak, thisQclass.backend.max_qubits)
+        counts = thisQclass.get_counts()
+        self.assertEqual(len(counts), 1)
+        self.assertEqual(a.extract_counts(counts), {2**31: 1024})
+        self.assertEqual(b.extract_counts(counts), {2**31 + 5: 1024})
+        self.assertFalse(is_classical([qop("h", (0,), (), ())]))
+        self.assertEqual(thisQclass.engine, "classical")
+
+    def test_stabilizer(self):
+        """
+        Tests whether a wide Clifford circuit is sampled from a stabilizer
+        tableau and anything else still gets the statevector
+        """
+        thisQclass = qclass(backend= qsim(n_qubits= 128, seed= 7))
+        thisQclass.start()
+        a = qint(thisQclass, size= 36)
+        a.all_vals()
+        first = qbool(thisQclass, prob= 0.5)
+        copies = [first.entangle() for i in range(4)]
+        a.measure()
+        for b in [first] + copies:
+            b.measure()
+        counts = thisQclass.get_counts()
+        self.assertEqual(thisQclass.engine, "stabilizer")
+        self.assertEqual(sum(counts.values()), 1024)
+        self.assertGreater(len(a.extract_counts(counts)), 1000)
+        self.assertEqual(set(thisQclass.extract_counts(counts, first, *copies)), {(False,)*5, (True,)*5})
+        self.qclass.q_prob(0, 0.3)
+        self.qclass.measure(0, 0)
+        self.qclass.get_counts()
+        self.assertEqual(self.qclass.engine, "statevector")
+
+    def test_lazy_backend(self):
+        """
+        Tests whether a named backend is only looked up when it runs
+        and whether a qubit budget can be given up front
+        """
+        thisQclass = qclass(backend= "ibmqx4")
+        thisQclass.start()
+        thisInt = qint(thisQclass, value= 3)
+        thisInt.increment()
+        self.assertIsNone(thisQclass._backend)
+        self.assertEqual((thisQclass.size, len(thisInt.qubits)), (5, 5))
+        self.assertEqual(qclass(backend= "ibmq_some_device", size= 7).size, 7)
+
+    def test_lazy_imports(self):
+        """
+        Tests whether building a circuit does not import qiskit
+        """
+        code = "import sys\nfrom qint import qint\nfrom qbool import qbool\nfrom qclass import qclass\n" \
+               "q = qclass()\nq.start()\nqint(q, value= 5).increment()\nprint('qiskit' in sys.modules)"
+        env = dict(os.environ, PYTHONPATH= os.path.dirname(os.path.abspath(sys.modules["qclass"].__file__)))
+        output = subprocess.run([sys.executable, "-c", code], env= env, stdout= subprocess.PIPE, check= True).stdout
+        self.assertEqual(output.decode().strip(), "False")
+
+
+
+class TestQallocator(unittest.TestCase):
+    """
+    Tests the index allocator behind chunk
+    """
+    def test_topology_connected(self):
+        """
+        Tests whether a topology places chunks on
+        connected qubits next to the given ones
+        """
+        ring = [[i, (i + 1) % 8] for i in range(8)]
+        allocator = qallocator(8, qtopology(ring))
+        allocator.claim([1, 3])
+        self.assertEqual(allocator.allocate(3), [0, 6, 7]) #Wraps around the ring
+        self.assertEqual(allocator.allocate(1, near= [6]), [5])
+        self.assertEqual(allocator.allocate(1, near= [1]), [2])
+
+    def test_heap_bounded(self):
+        """
+        Tests whether repeated allocate and free cycles
+        do not grow the free index heap
+        """
+        ring = [[i, (i + 1) % 8] for i in range(8)]
+        for allocator in (qallocator(8), qallocator(8, qtopology(ring))):
+            for i in range(1000):
+                allocator.free(allocator.allocate(3))
+                allocator.free(allocator.allocate_range(3))
+            self.assertLessEqual(len(allocator._heap), 8)
+            self.assertEqual(allocator.allocate(2), [0, 1])
+
+    def test_lowest_first(self):
+        """
+        Tests whether freed indices are reused lowest first
+        """
+        allocator = qallocator(8)
+        first = allocator.allocate(3)
+        allocator.allocate(2)
+        allocator.free([first[1], first[0]])
+        self.assertEqual(allocator.allocate(3), [0, 1, 5])
+
+    def test_counters(self):
+        """
+        Tests whether peak and high water counters track allocations
+        """
+        allocator = qallocator(8)
+        bits = allocator.allocate(4)
+        allocator.free(bits)
+        allocator.allocate(2)
+        self.assertEqual((allocator.inUse, allocator.peak, allocator.highWater), (2, 4, 4))
+
+    def test_range(self):
+        """
+        Tests whether a contiguous request skips fragmented gaps
+        """
+        allocator = qallocator(8)
+        bits = allocator.allocate(4)
+        allocator.free([bits[1]])
+        self.assertEqual(allocator.allocate_range(2), [4, 5])
+        self.assertEqual(allocator.allocate(1), [1])
+
+    def test_request_and_double_free(self):
+        """
+        Tests request returning False and freeing twice raising
+        """
+        allocator = qallocator(4)
+        self.assertFalse(allocator.request(5))
+        bits = allocator.request(4)
+        self.assertEqual(allocator.available, 0)
+        allocator.free(bits)
+        self.assertRaises(ValueError, allocator.free, bits)
+
+
+
+class TestQoptimizer(unittest.TestCase):
+    """
+    Tests the peephole passes run before execution
+    """
+    def test_cascading_cancel(self):
+        """
+        Tests whether nested inverse pairs all cancel
+        """
+        instructions = [qop("h", (0,), (), ()), qop("x", (0,), (), ()), qop("x", (0,), (), ()),
+                        qop("h", (0,), (), ()), qop("measure", (0,), (0,), ())]
+        optimized, report = qoptimizer.optimize(instructions)
+        self.assertEqual(optimized, [qop("measure", (0,), (0,), ())])
+        self.assertEqual((report["gates_before"], report["gates_after"]), (5, 1))
+
+    def test_blocked_cancel(self):
+        """
+        Tests whether a gate in between on a shared
+        qubit stops a pair from cancelling
+        """
+        instructions = [qop("cx", (0, 1), (), ()), qop("x", (1,), (), ()), qop("cx", (0, 1), (), ()),
+                        qop("measure", (1,), (0,), ())]
+        optimized, report = qoptimizer.optimize(instructions)
+        self.assertEqual(optimized, instructions)
+
+    def test_merge_rotations(self):
+        """
+        Tests whether consecutive rotations merge
+        """
+        instructions = [qop("rx", (0,), (), (0.5,)), qop("rx", (0,), (), (0.25,)), qop("measure", (0,), (0,), ())]
+        optimized, report = qoptimizer.optimize(instructions)
+        self.assertEqual(optimized, [qop("rx", (0,), (), (0.75,)), qop("measure", (0,), (0,), ())])
+
+    def test_drop_unmeasured(self):
+        """
+        Tests whether gates that never reach a
+        measured qubit are dropped
+        """
+        instructions = [qop("h", (2,), (), ()), qop("cx", (0, 1), (), ()), qop("h", (0,), (), ()),
+                        qop("measure", (1,), (0,), ())]
+        optimized, report = qoptimizer.optimize(instructions)
+        self.assertEqual(optimized, [qop("cx", (0, 1), (), ()), qop("measure", (1,), (0,), ())])